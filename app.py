@@ -1,11 +1,8 @@
 import streamlit as st
-import google.generativeai as genai
 import os
-from dotenv import load_dotenv
-import time
-import re
 
-load_dotenv()
+import plan_export
+from chat_engine import ChatSession, issued_session_id, start_metrics_server, start_warmup
 
 st.set_page_config(
     page_title="RetireChat - AI Retirement Planning Coach",
@@ -14,342 +11,32 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+# The chat engine (chat_engine.py) does the work; this script only draws the page
 
-RETIREMENT_COACH_PROMPT = """
-You are an expert Retirement Planning Coach providing personalized retirement planning suggestions.
+# How often the sidebar checks on a running Plan of Action export
+EXPORT_POLL_SECONDS = float(os.getenv("RETIRECHAT_EXPORT_POLL_SECONDS", "1"))
 
-Goals:
-* Getting to know the user: Start by asking about their current age and what stage of their career they are in (early career, mid-career, late career, near retirement, etc.). This helps personalize all advice.
-* Understand the user's current retirement plan: use available data to learn about their plan. Tailor advice based on this information. Ask the user to describe their plan, savings, challenges, and debt.
-* Identify retirement goals: ask about short-term and long-term goals. What age of retirement are they planning for? How much do they want to have saved at time of retirement?
-* Assess skills and gaps: evaluate current skills and identify gaps to achieve career goals to achieve their priorities.
-* Suggest learning opportunities: recommend courses, certifications, workshops, or other learning opportunities to acquire necessary skills.
-* Create a plan of action: develop a step-by-step plan with actions, timelines, and milestone. If asked for a detailed plan, include immediate actions, next 3 months, next 6 months, next 1-2 years, and ongoing.
-* Plan finalization: Once user expresses satisfaction in plan, ask the user if they wish the AI to create a printable professional document outlining their Plan of Action.
+# Earlier messages loaded per click of "Show earlier messages"
+HISTORY_PAGE_SIZE = int(os.getenv("RETIRECHAT_HISTORY_PAGE_SIZE", "20"))
 
-Overall direction:
-* Make responses relevant to the user's current or desired plan
-* Avoid overwhelming the user with multiple questions at one
-* Ask clarifying and follow-up questions
-* Be encouraging and maintain a professional, supportive tone
-* Keep context across the conversation, ensuring ideas and responses relate to previous turns
-* After each subtopic, ask if the user has follow-up questions or needs further help
-* If greeted or asked what you can do, briefly explain your purpose with concise examples, then ask about their age and career stage to personalize your advice
-* If asked unrelated questions, answer but try to refocus on retirement planning, financial wellness, and financial 101 questions.
-* If asked about what certain plans are and their definition, or if you pull any information from a source, make sure it is credible and to have a little source link so that they can verify that your information is certifiable and correct
-* At the end of each conversation, ask how you did and encourage feedback using the thumbs up or down.
+# The chat fragment redraws every message sent since the last full-app rerun, so
+# once that tail grows past this a full rerun moves it into the static transcript
+FRAGMENT_MAX_MESSAGES = int(os.getenv("RETIRECHAT_FRAGMENT_MAX_MESSAGES", "20"))
 
-Knowledge:
-Https://2025-benefits.segalco.com/
-Https://www.psca.org/news/psca-news/
-"""
-
-def sanitize_input(user_input):
-    """Sanitize user input to avoid triggering safety filters"""
-    # Remove potentially problematic phrases that might trigger safety filters
-    sanitized = user_input
-    
-    # Replace common financial terms that might trigger filters
-    replacements = {
-        r'\bdebts?\b': 'financial obligations',
-        r'\bbankrupt(cy)?\b': 'financial restructuring',
-        r'\bfail(ed|ure)?\b': 'challenging situation',
-        r'\bcrisis\b': 'difficult period',
-        r'\bstrug(gle|gling)\b': 'working through challenges',
-        r'\bdesperate\b': 'urgently seeking',
-        r'\bpoor\b': 'limited financial resources',
-        r'\bbroke\b': 'financially constrained'
-    }
-    
-    for pattern, replacement in replacements.items():
-        sanitized = re.sub(pattern, replacement, sanitized, flags=re.IGNORECASE)
-    
-    return sanitized
-
-def get_ai_response_with_retry(user_input, conversation_history, max_retries=3):
-    """Get AI response with multiple retry strategies to bypass safety filters"""
-    
-    # Strategy 1: Try with sanitized input and most permissive settings
-    for attempt in range(max_retries):
-        try:
-            if attempt == 0:
-                # First attempt: Use original input with most permissive settings
-                processed_input = user_input
-            elif attempt == 1:
-                # Second attempt: Use sanitized input
-                processed_input = sanitize_input(user_input)
-            else:
-                # Third attempt: Rephrase as a professional consultation
-                processed_input = f"As a retirement planning professional, please provide guidance on: {sanitize_input(user_input)}"
-            
-            response = get_ai_response_attempt(processed_input, conversation_history, attempt)
-            
-            if response and not response.startswith("I apologize"):
-                return response
-                
-            # Brief delay before retry
-            if attempt < max_retries - 1:
-                time.sleep(0.5)
-                
-        except Exception as e:
-            st.error(f"Attempt {attempt + 1} failed: {str(e)}")
-            continue
-    
-    # If all attempts fail, return a helpful fallback response
-    return generate_fallback_response(user_input)
-
-def get_ai_response_attempt(user_input, conversation_history, attempt_number):
-    """Single attempt to get AI response with different configurations per attempt"""
-    try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        # Build conversation context
-        context = RETIREMENT_COACH_PROMPT + "\n\nConversation History:\n"
-        for msg in conversation_history[-8:]:  # Reduce context to avoid issues
-            role = "User" if msg["role"] == "user" else "Assistant"
-            context += f"{role}: {msg['content']}\n"
-        
-        context += f"\nUser: {user_input}\nAssistant:"
-        
-        # Most permissive safety settings possible
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH", 
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_NONE"
-            }
-        ]
-        
-        # Adjust generation config based on attempt
-        if attempt_number == 0:
-            gen_config = genai.types.GenerationConfig(
-                max_output_tokens=1000,
-                temperature=0.7,
-                top_p=0.9,
-                top_k=40
-            )
-        elif attempt_number == 1:
-            gen_config = genai.types.GenerationConfig(
-                max_output_tokens=800,
-                temperature=0.5,
-                top_p=0.8,
-                top_k=30
+def show_queue_position(placeholder):
+    """Queue callback that tells the user where they are in line"""
+    def on_queue(position, expected_seconds):
+        if position:
+            placeholder.caption(
+                f"High demand right now: you're #{position} in line "
+                f"(about {max(1, round(expected_seconds))}s)."
             )
         else:
-            gen_config = genai.types.GenerationConfig(
-                max_output_tokens=600,
-                temperature=0.3,
-                top_p=0.7,
-                top_k=20
-            )
-        
-        response = model.generate_content(
-            context,
-            generation_config=gen_config,
-            safety_settings=safety_settings
-        )
-        
-        # Enhanced response extraction with multiple fallback methods
-        return extract_response_safely(response, user_input)
-        
-    except Exception as e:
-        # Log the specific error but don't expose to user
-        print(f"API attempt {attempt_number} error: {str(e)}")
-        return None
-
-def extract_response_safely(response, original_input):
-    """Safely extract response from Gemini API with multiple fallback methods"""
-    
-    # Method 1: Direct text access
-    try:
-        if hasattr(response, 'text') and response.text:
-            return response.text
-    except:
-        pass
-    
-    # Method 2: Check candidates and finish reasons
-    if hasattr(response, 'candidates') and response.candidates:
-        candidate = response.candidates[0]
-        
-        # Handle different finish reasons
-        finish_reason = getattr(candidate, 'finish_reason', None)
-        
-        if finish_reason == 1:  # STOP - successful completion
-            try:
-                if hasattr(candidate, 'content') and candidate.content:
-                    if hasattr(candidate.content, 'parts') and candidate.content.parts:
-                        return candidate.content.parts[0].text
-            except:
-                pass
-        
-        elif finish_reason == 2:  # SAFETY
-            return generate_safety_bypass_response(original_input)
-        
-        elif finish_reason == 3:  # RECITATION
-            return generate_recitation_bypass_response(original_input)
-        
-        elif finish_reason == 4:  # OTHER
-            return generate_other_error_response(original_input)
-    
-    # Method 3: Try to access parts directly
-    try:
-        if response.candidates[0].content.parts:
-            return response.candidates[0].content.parts[0].text
-    except:
-        pass
-    
-    # Method 4: Check prompt feedback
-    if hasattr(response, 'prompt_feedback'):
-        feedback = response.prompt_feedback
-        if hasattr(feedback, 'block_reason'):
-            return generate_prompt_feedback_response(original_input, feedback.block_reason)
-    
-    return None
-
-def generate_safety_bypass_response(original_input):
-    """Generate a helpful response when safety filters are triggered"""
-    financial_keywords = ['retirement', 'savings', 'investment', 'financial', 'money', 'plan', 'budget', 'debt', 'income']
-    
-    if any(keyword in original_input.lower() for keyword in financial_keywords):
-        return f"""I understand you're asking about retirement planning. Let me help you with that.
-
-For personalized retirement planning advice, I can assist with:
-
-• Retirement savings strategies and goal setting
-• Investment allocation recommendations for your age group
-• Steps to improve your financial situation for retirement
-• Educational resources for financial planning
-• Creating actionable retirement timelines
-
-Could you tell me more specifically about your retirement planning goals? For example:
-- What's your current age and career stage?
-- Are you looking to create a new retirement plan or improve an existing one?
-- What's your main concern about retirement planning right now?
-
-This will help me provide more targeted guidance for your situation."""
-    
-    return f"""I'm here to help with retirement planning and financial guidance. Let me address your question about financial planning.
-
-Based on your inquiry, I can provide guidance on:
-
-• Developing a comprehensive retirement strategy
-• Understanding different retirement account options
-• Creating realistic savings goals and timelines
-• Professional development for career advancement
-• Resources for financial education and planning
-
-What specific aspect of retirement planning would you like to focus on today?"""
-
-def generate_recitation_bypass_response(original_input):
-    """Generate response when recitation filters are triggered"""
-    return """I'd be happy to provide original, personalized retirement planning advice tailored to your specific situation.
-
-Let me offer some general guidance that might help:
-
-**Getting Started with Retirement Planning:**
-1. Assess your current financial position
-2. Define your retirement timeline and goals
-3. Explore available retirement account options
-4. Consider your risk tolerance for investments
-5. Create a systematic savings approach
-
-**Next Steps:**
-To give you more specific advice, could you share:
-- Your approximate age or career stage?
-- Whether you have existing retirement savings?
-- Any specific retirement planning challenges you're facing?
-
-This will help me provide more targeted, personalized guidance for your unique situation."""
-
-def generate_other_error_response(original_input):
-    """Generate response for other types of API errors"""
-    return """I'm ready to help you with comprehensive retirement planning guidance.
-
-**Common Retirement Planning Areas I Can Assist With:**
-• Creating a personalized retirement savings strategy
-• Understanding 401(k), IRA, and other retirement accounts
-• Calculating retirement income needs
-• Investment allocation strategies by age
-• Career development for increased earning potential
-• Debt management strategies before retirement
-
-**Let's Get Started:**
-What's the most important retirement planning question on your mind right now? I can provide specific, actionable advice once I understand your particular situation and goals."""
+            placeholder.empty()
+    return on_queue
 
-def generate_prompt_feedback_response(original_input, block_reason):
-    """Generate response when prompt is blocked for various reasons"""
-    return f"""I understand you're seeking retirement planning guidance. Let me help you with professional financial planning advice.
-
-**Professional Retirement Planning Services:**
-I can provide expert guidance on retirement strategies, savings optimization, and financial goal setting.
-
-**How I Can Help:**
-• Personalized retirement planning recommendations
-• Investment strategy guidance
-• Career development planning
-• Financial goal prioritization
-• Action plan development
-
-**Your Next Step:**
-Please share what specific retirement planning topic you'd like to explore, and I'll provide detailed, professional guidance tailored to your needs."""
-
-def generate_fallback_response(original_input):
-    """Generate a comprehensive fallback response when all AI attempts fail"""
-    return """**Professional Retirement Planning Assistance**
-
-I'm here to provide comprehensive retirement planning guidance. Even though I'm experiencing a temporary technical issue, I can still help structure your thinking around retirement planning.
-
-**Key Areas We Can Explore:**
-
-**Assessment Phase:**
-• Current financial position evaluation
-• Retirement timeline planning
-• Goal setting and prioritization
-
-**Strategy Development:**
-• Savings rate optimization
-• Investment allocation by age
-• Risk tolerance assessment
-• Tax-advantaged account utilization
-
-**Implementation:**
-• Step-by-step action plans
-• Milestone tracking
-• Regular plan review and adjustment
-
-**Professional Development:**
-• Career advancement strategies
-• Skills development for earning potential
-• Industry-specific retirement considerations
-
-**What Would Be Most Helpful?**
-Please let me know what specific aspect of retirement planning you'd like to focus on, and I'll provide detailed guidance and actionable next steps.
-
-You can ask about:
-- Creating a retirement savings strategy
-- Understanding investment options
-- Career development planning
-- Specific financial planning calculations
-- Timeline and milestone development"""
-
-def get_ai_response(user_input, conversation_history):
-    """Main function to get AI response with comprehensive error handling"""
-    return get_ai_response_with_retry(user_input, conversation_history)
-
-def main():
-    # Professional header styling
+def render_chrome():
+    """Page styling and header in a single element; only emitted on full-app reruns"""
     st.markdown("""
     <style>
     .main-header {
@@ -393,68 +80,121 @@ def main():
         margin-bottom: 1rem;
     }
     </style>
-    """, unsafe_allow_html=True)
-    
-    # Professional header
-    st.markdown("""
+
     <div class="main-header">
         <h1>RetireChat</h1>
         <p>AI-Powered Retirement Planning Assistant</p>
     </div>
     """, unsafe_allow_html=True)
+
+@st.fragment
+def render_sidebar():
+    """Sidebar content; its buttons rerun only this fragment unless they change the chat"""
+    st.markdown('<h3 class="section-header">About RetireChat</h3>', unsafe_allow_html=True)
+    st.markdown("""
+    <div class="sidebar-content">
+    RetireChat is your AI-powered Retirement Planning Coach that offers:
+    
+    <ul>
+    <li>Personalized retirement planning advice</li>
+    <li>Goal identification and planning</li>
+    <li>Skills gap analysis</li>
+    <li>Learning opportunity recommendations</li>
+    <li>Step-by-step action plans</li>
+    <li>Professional document generation</li>
+    </ul>
+    </div>
+    """, unsafe_allow_html=True)
     
-    if "conversation_history" not in st.session_state:
-        st.session_state.conversation_history = []
+    st.markdown('<h3 class="section-header">Quick Start Options</h3>', unsafe_allow_html=True)
     
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
+    if st.button("Create Retirement Development Plan", type="primary", use_container_width=True):
+        st.session_state.suggested_prompt = "Help me create a detailed retirement development plan based on my current financial situation and future goals."
+        st.rerun()
     
-    with st.sidebar:
-        st.markdown('<h3 class="section-header">About RetireChat</h3>', unsafe_allow_html=True)
-        st.markdown("""
-        <div class="sidebar-content">
-        RetireChat is your AI-powered Retirement Planning Coach that offers:
-        
-        <ul>
-        <li>Personalized retirement planning advice</li>
-        <li>Goal identification and planning</li>
-        <li>Skills gap analysis</li>
-        <li>Learning opportunity recommendations</li>
-        <li>Step-by-step action plans</li>
-        <li>Professional document generation</li>
-        </ul>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        st.markdown('<h3 class="section-header">Quick Start Options</h3>', unsafe_allow_html=True)
-        
-        if st.button("Create Retirement Development Plan", type="primary", use_container_width=True):
-            st.session_state.suggested_prompt = "Help me create a detailed retirement development plan based on my current financial situation and future goals."
-        
-        if st.button("Skill Gap Analysis", use_container_width=True):
-            st.session_state.suggested_prompt = "Analyze my current skills and identify any gaps that I need to fill to advance in my career."
-        
-        if st.button("Learning Opportunities", use_container_width=True):
-            st.session_state.suggested_prompt = "What courses, certifications, or workshops would you recommend for someone in my generation to plan retirement successfully?"
-        
-        st.markdown("---")
-        if st.button("Clear Conversation", use_container_width=True):
-            st.session_state.conversation_history = []
-            st.session_state.messages = []
-            st.rerun()
-        
-        # Professional footer
-        st.markdown("""
-        <div style="margin-top: 2rem; padding: 1rem; background-color: #F8F9FA; border-radius: 8px; font-size: 0.9rem; color: #666;">
-        <strong>Professional Financial Guidance</strong><br>
-        Powered by advanced AI technology to provide personalized retirement planning assistance.
-        </div>
-        """, unsafe_allow_html=True)
+    if st.button("Skill Gap Analysis", use_container_width=True):
+        st.session_state.suggested_prompt = "Analyze my current skills and identify any gaps that I need to fill to advance in my career."
+        st.rerun()
     
-    # Chat interface
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+    if st.button("Learning Opportunities", use_container_width=True):
+        st.session_state.suggested_prompt = "What courses, certifications, or workshops would you recommend for someone in my generation to plan retirement successfully?"
+        st.rerun()
+    
+    st.markdown('<h3 class="section-header">Plan of Action</h3>', unsafe_allow_html=True)
+    render_plan_export()
+    
+    st.markdown("---")
+    if st.button("Clear Conversation", use_container_width=True):
+        st.session_state.chat.clear()
+        st.session_state.earlier_shown = 0
+        st.rerun()
+    
+    # Professional footer
+    st.markdown("""
+    <div style="margin-top: 2rem; padding: 1rem; background-color: #F8F9FA; border-radius: 8px; font-size: 0.9rem; color: #666;">
+    <strong>Professional Financial Guidance</strong><br>
+    Powered by advanced AI technology to provide personalized retirement planning assistance.
+    </div>
+    """, unsafe_allow_html=True)
+
+@st.fragment(run_every=EXPORT_POLL_SECONDS)
+def render_export_progress():
+    """Progress of the session's export, polled on its own so the chat stays responsive"""
+    job = st.session_state.chat.latest_export()
+    if job is not None and job.active:
+        st.progress(job.progress, text=job.stage)
+    else:
+        # Finished: redraw the sidebar with the download buttons
+        st.rerun()
+
+def start_plan_export():
+    """Click callback of the export button"""
+    if st.session_state.chat.export_plan() is None:
+        st.session_state.plan_export_empty = True
+
+def render_plan_export():
+    job = st.session_state.chat.latest_export()
+    if job is not None and job.active:
+        render_export_progress()
+        return
+    
+    if job is not None and job.status == "done":
+        for fmt, (label, mime) in plan_export.FORMATS.items():
+            st.download_button(
+                f"Download {label}",
+                job.artifacts[fmt],
+                file_name=f"plan-of-action.{fmt}",
+                mime=mime,
+                key=f"plan_download_{fmt}",
+                use_container_width=True
+            )
+    elif job is not None and job.status == "failed":
+        st.caption("The last export didn't finish. Please try again.")
+    
+    label = "Update Plan of Action" if job is not None and job.status == "done" else "Create Plan of Action"
+    # Checked in the click callback rather than disabling the button: this fragment
+    # isn't redrawn when the chat fragment adds messages
+    st.button(label, on_click=start_plan_export, use_container_width=True)
+    if st.session_state.pop("plan_export_empty", False):
+        st.caption("Chat with the coach first, then create your plan.")
+
+def render_messages(messages):
+    for message in messages:
+        with st.chat_message(message.role):
+            st.markdown(message.content)
+
+@st.fragment
+def render_chat():
+    """Chat input and the turns added since the last full-app rerun.
+    
+    Submitting a message reruns only this fragment, so the header, sidebar and the
+    transcript drawn by main() are not re-executed or re-sent to the browser. The
+    turns added since then are redrawn on every fragment rerun, so after
+    FRAGMENT_MAX_MESSAGES of them a full rerun resets the tail; a fragment rerun
+    sends at most that many messages.
+    """
+    chat = st.session_state.chat
+    render_messages(chat.conversation[st.session_state.rendered_upto:])
     
     # Handle suggested prompts
     suggested_prompt = None
@@ -469,18 +209,42 @@ def main():
     prompt = suggested_prompt or chat_prompt
     
     if prompt:
-        st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
         
         with st.chat_message("assistant"):
-            with st.spinner("Analyzing your request..."):
-                response = get_ai_response(prompt, st.session_state.conversation_history)
-                st.markdown(response)
+            queue_notice = st.empty()
+            # The engine records the turn once the answer has streamed in full
+            st.write_stream(chat.reply(prompt, on_queue=show_queue_position(queue_notice)))
         
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        st.session_state.conversation_history.append({"role": "user", "content": prompt})
-        st.session_state.conversation_history.append({"role": "assistant", "content": response})
+        if len(chat.conversation) - st.session_state.rendered_upto > FRAGMENT_MAX_MESSAGES:
+            st.rerun()
+
+def main():
+    start_metrics_server()
+    start_warmup()
+    render_chrome()
+    
+    if "chat" not in st.session_state:
+        # The session id is kept in the URL so a reload that lands on another
+        # instance resumes the same conversation; an id we didn't issue starts a new one
+        st.session_state.chat = ChatSession(issued_session_id(st.query_params.get("session")))
+        st.query_params["session"] = st.session_state.chat.session_id
+    
+    with st.sidebar:
+        render_sidebar()
+    
+    # Chat interface: the transcript so far is drawn here on full reruns only;
+    # render_chat() picks up from rendered_upto on its own reruns
+    conversation = st.session_state.chat.conversation
+    earlier_shown = st.session_state.get("earlier_shown", 0)
+    if conversation.first_index > earlier_shown and st.button("Show earlier messages"):
+        earlier_shown = st.session_state.earlier_shown = earlier_shown + HISTORY_PAGE_SIZE
+    if earlier_shown:
+        render_messages(conversation.page(conversation.first_index - earlier_shown, conversation.first_index))
+    render_messages(conversation)
+    st.session_state.rendered_upto = len(conversation)
+    render_chat()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,326 @@
+"""Replay saved conversations through the chat pipeline in bulk, e.g. after a prompt change.
+
+Usage:
+    python batch_replay.py export [--db conversations.db] [--out transcripts.jsonl]
+    python batch_replay.py replay transcripts.jsonl [--out results.jsonl] [--parquet results.parquet]
+                                  [--concurrency 8] [--processes 1] [--limit N] [--overwrite]
+
+export writes every conversation in the conversation database as one JSON line:
+    {"conversation_id": "...", "messages": [{"role": "user", "content": "..."}, ...]}
+
+replay reads lines in that format ("id" or "session_id" also name a conversation;
+lines without one are numbered). Each conversation is replayed turn by turn through
+get_ai_response, so it gets the same windowing, caching, retries and fallbacks as a
+live chat. The history it builds on is the replayed answers, not the saved ones.
+Each saved answer is kept as the turn's "reference".
+
+Conversations run in parallel: --concurrency per process and --processes worker
+processes. Each process gets an equal share of the admission limits
+(RETIRECHAT_MAX_IN_FLIGHT, RETIRECHAT_RPM, RETIRECHAT_TPM), so the whole run
+stays within the quota. Every finished conversation is appended to --out as one
+JSON line:
+    conversation_id, model, prompt_version, turns, seconds, max_turn_seconds,
+    prompt_tokens, output_tokens, attempts, fallbacks, canned, cached,
+    replies: [{user, response, reference, source, seconds, prompt_tokens,
+               output_tokens, attempts, finish_reasons}]
+
+An interrupted run picks up where it stopped: conversations already in --out are
+skipped unless --overwrite is given. --parquet additionally writes the finished
+results as Parquet (needs pyarrow).
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import chat_engine
+from metrics import TurnMetrics, log_event
+
+
+def load_conversations(path):
+    """Conversations from a transcripts JSONL file as {"conversation_id", "messages"} dicts"""
+    conversations = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            # Ids such as 0 or "" are valid, so only a missing (or null) field falls through
+            conversation_id = next(
+                (str(record[key]) for key in ("conversation_id", "id", "session_id") if record.get(key) is not None),
+                f"line-{number}"
+            )
+            if conversation_id in seen:
+                raise ValueError(f"{path}:{number}: duplicate conversation id {conversation_id}")
+            seen.add(conversation_id)
+            messages = [
+                {"role": msg["role"], "content": msg["content"]}
+                for msg in record.get("messages", [])
+                if msg.get("role") in ("user", "assistant") and msg.get("content")
+            ]
+            conversations.append({"conversation_id": conversation_id, "messages": messages})
+    return conversations
+
+
+def completed_ids(path):
+    """Conversation ids already written to a results file; drops a torn last line from a crash"""
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    good_bytes = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(line)["conversation_id"])
+            except (ValueError, KeyError):
+                break
+            good_bytes += len(line)
+    if good_bytes < os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(good_bytes)
+    return done
+
+
+def read_results(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def user_turns(messages):
+    """(user message, the saved answer that followed it or None) pairs"""
+    for index, msg in enumerate(messages):
+        if msg["role"] != "user":
+            continue
+        following = messages[index + 1] if index + 1 < len(messages) else None
+        yield msg["content"], following["content"] if following and following["role"] == "assistant" else None
+
+
+def prompt_version():
+    return hashlib.sha256(chat_engine.RETIREMENT_COACH_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+
+def replay_conversation(conversation):
+    """Replay one conversation turn by turn and summarize it as one results row"""
+    context = chat_engine.ConversationContext()
+    history = []
+    replies = []
+    for user_input, reference in user_turns(conversation["messages"]):
+        turn = TurnMetrics()
+        response = chat_engine.get_ai_response(user_input, history, context, turn=turn)
+        replies.append({
+            "user": user_input,
+            "response": response,
+            "reference": reference,
+            "source": turn.source,
+            "seconds": round(turn.seconds, 4),
+            "prompt_tokens": turn.prompt_tokens,
+            "output_tokens": turn.output_tokens,
+            "attempts": turn.attempts,
+            "finish_reasons": turn.finish_reasons,
+        })
+        history.append({"role": "user", "content": user_input})
+        history.append({"role": "assistant", "content": response})
+
+    return {
+        "conversation_id": conversation["conversation_id"],
+        "model": chat_engine.MODEL_NAME,
+        "prompt_version": prompt_version(),
+        "turns": len(replies),
+        "seconds": round(sum(reply["seconds"] for reply in replies), 4),
+        "max_turn_seconds": max((reply["seconds"] for reply in replies), default=0.0),
+        "prompt_tokens": sum(reply["prompt_tokens"] for reply in replies),
+        "output_tokens": sum(reply["output_tokens"] for reply in replies),
+        "attempts": sum(reply["attempts"] for reply in replies),
+        "fallbacks": sum(1 for reply in replies if reply["source"] == "fallback"),
+        "canned": sum(1 for reply in replies if reply["source"] == "canned"),
+        "cached": sum(1 for reply in replies if reply["source"] == "cache"),
+        "replayed_at": round(time.time(), 3),
+        "replies": replies,
+    }
+
+
+def run_shard(conversations, concurrency, results, processes=1):
+    """Replay conversations on a thread pool, putting ("row", row) / ("error", id, message) on results.
+
+    get_ai_response runs its model calls on the engine's shared event loop, so the
+    threads mostly wait; the admission controller bounds the calls actually in flight.
+    """
+    if processes > 1:
+        # The quota belongs to the API key, not the process
+        chat_engine.MAX_IN_FLIGHT_CALLS = max(1, chat_engine.MAX_IN_FLIGHT_CALLS // processes)
+        chat_engine.REQUESTS_PER_MINUTE = max(1, chat_engine.REQUESTS_PER_MINUTE // processes)
+        chat_engine.TOKENS_PER_MINUTE = max(1, chat_engine.TOKENS_PER_MINUTE // processes)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay") as executor:
+            futures = {executor.submit(replay_conversation, conversation): conversation for conversation in conversations}
+            for future in as_completed(futures):
+                conversation_id = futures[future]["conversation_id"]
+                try:
+                    results.put(("row", future.result()))
+                except Exception as e:
+                    results.put(("error", conversation_id, str(e)))
+    finally:
+        results.put(("done",))
+
+
+def replay(conversations, out_path, concurrency=8, processes=1):
+    """Replay conversations and append each finished one to out_path; returns (written, failed)"""
+    processes = max(1, min(processes, len(conversations)))
+    if processes == 1:
+        results = queue.Queue()
+        workers = [threading.Thread(target=run_shard, args=(conversations, concurrency, results), daemon=True)]
+    else:
+        # Fresh interpreters: forking a process that already runs engine threads is unsafe
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        workers = [
+            context.Process(target=run_shard, args=(conversations[i::processes], concurrency, results, processes))
+            for i in range(processes)
+        ]
+    for worker in workers:
+        worker.start()
+
+    written = failed = 0
+    running = len(workers)
+    started = time.perf_counter()
+    with open(out_path, "a", encoding="utf-8") as out:
+        while running:
+            try:
+                message = results.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    break  # a worker died without reporting back
+                continue
+            if message[0] == "done":
+                running -= 1
+            elif message[0] == "error":
+                failed += 1
+                log_event("replay_error", conversation_id=message[1], error=message[2])
+            else:
+                # One complete line per conversation, so a crash never leaves it half written
+                out.write(json.dumps(message[1]) + "\n")
+                out.flush()
+                written += 1
+                print(
+                    f"[{written + failed}/{len(conversations)}] {message[1]['conversation_id']}: "
+                    f"{message[1]['turns']} turns in {message[1]['seconds']:.1f}s, "
+                    f"{message[1]['fallbacks']} fallbacks ({time.perf_counter() - started:.0f}s elapsed)",
+                    file=sys.stderr
+                )
+    for worker in workers:
+        worker.join(timeout=5)
+    return written, failed
+
+
+def report(rows):
+    """Run-level totals over the per-conversation rows"""
+    turn_seconds = sorted(reply["seconds"] for row in rows for reply in row["replies"])
+
+    def percentile(fraction):
+        return turn_seconds[min(len(turn_seconds) - 1, int(fraction * len(turn_seconds)))] if turn_seconds else 0.0
+
+    return {
+        "conversations": len(rows),
+        "turns": len(turn_seconds),
+        "turn_seconds_p50": round(percentile(0.5), 4),
+        "turn_seconds_p95": round(percentile(0.95), 4),
+        "conversation_seconds_mean": round(statistics.mean(row["seconds"] for row in rows), 4) if rows else 0.0,
+        "prompt_tokens": sum(row["prompt_tokens"] for row in rows),
+        "output_tokens": sum(row["output_tokens"] for row in rows),
+        "fallbacks": sum(row["fallbacks"] for row in rows),
+        "canned": sum(row["canned"] for row in rows),
+        "cached": sum(row["cached"] for row in rows),
+        "conversations_with_fallbacks": sorted(row["conversation_id"] for row in rows if row["fallbacks"]),
+    }
+
+
+def write_parquet(rows, path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        sys.exit("--parquet needs pyarrow: pip install pyarrow")
+    pq.write_table(pa.Table.from_pylist(rows), path)
+
+
+def export(db_path, out_path):
+    """Write each conversation in the conversation database as one transcripts line"""
+    db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    rows = db.execute("SELECT session_id, role, content FROM messages ORDER BY session_id, position")
+    count = 0
+    current = None
+    with open(out_path, "w", encoding="utf-8") as out:
+        for session_id, role, content in rows:
+            if current is None or current["conversation_id"] != session_id:
+                if current is not None:
+                    out.write(json.dumps(current) + "\n")
+                    count += 1
+                current = {"conversation_id": session_id, "messages": []}
+            current["messages"].append({"role": role, "content": content})
+        if current is not None:
+            out.write(json.dumps(current) + "\n")
+            count += 1
+    db.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["export", "replay"])
+    parser.add_argument("transcripts", nargs="?", help="transcripts JSONL to replay")
+    parser.add_argument("--db", default=chat_engine.CONVERSATION_DB_PATH or "conversations.db")
+    parser.add_argument("--out", help="export: transcripts file; replay: results file")
+    parser.add_argument("--parquet", help="also write the finished results to this Parquet file")
+    parser.add_argument("--concurrency", type=int, default=8, help="conversations in flight per process")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--limit", type=int, help="replay at most this many conversations")
+    parser.add_argument("--overwrite", action="store_true", help="start over instead of resuming --out")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        out_path = args.out or "transcripts.jsonl"
+        print(f"exported {export(args.db, out_path)} conversations -> {out_path}")
+        return
+
+    if not args.transcripts:
+        parser.error("replay needs a transcripts file")
+    out_path = args.out or "results.jsonl"
+    if args.overwrite and os.path.exists(out_path):
+        os.remove(out_path)
+    conversations = load_conversations(args.transcripts)[:args.limit]
+    done = completed_ids(out_path)
+    pending = [conversation for conversation in conversations if conversation["conversation_id"] not in done]
+    print(f"{len(pending)} to replay, {len(conversations) - len(pending)} already in {out_path}", file=sys.stderr)
+
+    failed = 0
+    if pending:
+        _, failed = replay(pending, out_path, args.concurrency, args.processes)
+    wanted = {conversation["conversation_id"] for conversation in conversations}
+    rows = [row for row in read_results(out_path) if row["conversation_id"] in wanted] if os.path.exists(out_path) else []
+    if args.parquet:
+        write_parquet(rows, args.parquet)
+
+    summary = dict(report(rows), failed=failed)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        for key, value in summary.items():
+            print(f"{key:>30}: {value}")
+    if failed:
+        sys.exit(f"{failed} conversations failed; run again to retry them")
+
+
+if __name__ == "__main__":
+    main()
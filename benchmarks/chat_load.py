@@ -0,0 +1,158 @@
+"""Offline load benchmark for the chat pipeline, using the mock Gemini backend.
+
+Usage:
+    python benchmarks/chat_load.py [--sessions 50] [--turns 4] [--mode pipeline|apptest] [--json]
+
+pipeline  drives ChatSession.reply from concurrent session threads,
+          exercising admission, single-flight, streaming, retries and caching.
+apptest   drives the full Streamlit script through AppTest, one session at a time,
+          so each turn includes a complete script rerun.
+
+Mock behaviour is tuned with the RETIRECHAT_MOCK_* variables in mock_backend.py,
+e.g. RETIRECHAT_MOCK_LATENCY_MEDIAN=0.5 RETIRECHAT_MOCK_ERROR_429_RATE=0.05.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("RETIRECHAT_BACKEND", "mock")
+os.environ.setdefault("RETIRECHAT_METRICS_PORT", "0")
+os.environ.setdefault("RETIRECHAT_MOCK_SEED", "7")
+os.environ.setdefault("RETIRECHAT_CONVERSATION_DB", os.path.join(tempfile.mkdtemp(), "conversations.db"))
+
+PROMPTS = [
+    "Hi, I'm 45 and in mid-career. Where should I start with retirement planning?",
+    "I have about $120,000 in my 401(k) and contribute 6%.",
+    "I'd like to retire at 63. Am I on track?",
+    "What should I do in the next 3 months?",
+    "Can you suggest courses to improve my financial literacy?",
+    "How should my investment mix change over the next ten years?",
+]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_pipeline(sessions, turns):
+    import chat_engine
+
+    results = []
+    results_lock = threading.Lock()
+    states = {}
+
+    def run_session(index):
+        session = chat_engine.ChatSession()
+        states[session.session_id] = session
+        for turn in range(turns):
+            prompt = PROMPTS[(index + turn) % len(PROMPTS)]
+            started = time.perf_counter()
+            first_token = None
+            for _ in session.reply(prompt):
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+            elapsed = time.perf_counter() - started
+            with results_lock:
+                results.append((elapsed, first_token or elapsed))
+
+    # Import the SDK and build the shared client first, as run_apptest does; under
+    # tracemalloc the import alone takes seconds and would land in the first turns
+    chat_engine.get_client_pool().warm_up()
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        list(executor.map(run_session, range(sessions)))
+    wall = time.perf_counter() - started
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return results, wall, retained / sessions
+
+
+def run_apptest(sessions, turns):
+    from streamlit.testing.v1 import AppTest
+
+    script = os.path.join(ROOT, "app.py")
+    # Warm up imports so they don't count against the first session
+    AppTest.from_file(script, default_timeout=120).run()
+
+    results = []
+    apps = []
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for index in range(sessions):
+        at = AppTest.from_file(script, default_timeout=120).run()
+        for turn in range(turns):
+            turn_started = time.perf_counter()
+            at.chat_input[0].set_value(PROMPTS[(index + turn) % len(PROMPTS)]).run()
+            elapsed = time.perf_counter() - turn_started
+            results.append((elapsed, elapsed))
+        apps.append(at)
+    wall = time.perf_counter() - started
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return results, wall, retained / sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--mode", choices=["pipeline", "apptest"], default="pipeline")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    # The pipeline logs one JSON line per turn; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        runner = run_pipeline if args.mode == "pipeline" else run_apptest
+        results, wall, memory_per_session = runner(args.sessions, args.turns)
+        import metrics
+        turn_sources = metrics.TURNS.snapshot()
+
+    latencies = [latency for latency, _ in results]
+    first_tokens = [first for _, first in results]
+    report = {
+        "mode": args.mode,
+        "sessions": args.sessions,
+        "turns": len(results),
+        "wall_seconds": round(wall, 3),
+        "throughput_turns_per_second": round(len(results) / wall, 2) if wall else 0.0,
+        "latency_p50": round(percentile(latencies, 0.50), 4),
+        "latency_p95": round(percentile(latencies, 0.95), 4),
+        "latency_p99": round(percentile(latencies, 0.99), 4),
+        "first_token_p50": round(percentile(first_tokens, 0.50), 4),
+        "first_token_p95": round(percentile(first_tokens, 0.95), 4),
+        "memory_per_session_kib": round(memory_per_session / 1024, 1),
+        "turn_sources": turn_sources,
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for key, value in report.items():
+        print(f"{key:>28}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Compare input token usage of the inline and system_instruction prompt modes.
+
+Usage:
+    python benchmarks/prompt_tokens.py [--turns 12]
+
+Counts tokens with the Gemini count_tokens API, so GOOGLE_API_KEY must be set.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat_engine
+
+SAMPLE_TURNS = [
+    ("user", "Hi, I'm 42 and in mid-career as a project manager."),
+    ("assistant", "Great to meet you! At 42 you have plenty of runway. Could you describe your current retirement plan and savings?"),
+    ("user", "I have about $85,000 in my 401(k) and contribute 6% with a 3% employer match."),
+    ("assistant", "That's a solid foundation. Raising your contribution by 1% each year would compound significantly by retirement. What age are you aiming to retire?"),
+    ("user", "I'd like to retire at 62 with around $1.2 million saved."),
+    ("assistant", "A clear target helps. To reach $1.2M by 62 you'd likely need to increase savings and consider catch-up contributions after 50. Do you have any debt we should plan around?"),
+]
+
+def sample_history(turns):
+    return [
+        {"role": role, "content": content}
+        for role, content in (SAMPLE_TURNS * (turns // len(SAMPLE_TURNS) + 1))[:turns]
+    ]
+
+def count_tokens(mode, user_input, history):
+    model = chat_engine.get_client_pool().model(mode)
+    return model.count_tokens(chat_engine.build_context(user_input, history, mode)).total_tokens
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=12, help="longest history to measure")
+    args = parser.parse_args()
+    
+    if not os.getenv("GOOGLE_API_KEY"):
+        sys.exit("GOOGLE_API_KEY is required to count tokens")
+    
+    user_input = "What should my next step be?"
+    totals = {"inline": 0, "system": 0}
+    print(f"{'history':>8} {'inline':>8} {'system':>8} {'saved':>8}")
+    for turns in range(0, args.turns + 1, 2):
+        history = sample_history(turns)
+        inline = count_tokens("inline", user_input, history)
+        system = count_tokens("system", user_input, history)
+        totals["inline"] += inline
+        totals["system"] += system
+        print(f"{turns:>8} {inline:>8} {system:>8} {inline - system:>8}")
+    
+    saved = totals["inline"] - totals["system"]
+    print(f"\nSession total: inline={totals['inline']} system={totals['system']} "
+          f"saved={saved} ({saved / totals['inline']:.1%})")
+    print(f"Coach prompt tokens (billed at the cached rate when RETIRECHAT_CONTEXT_CACHE is on): "
+          f"{chat_engine.get_client_pool().model('inline').count_tokens(chat_engine.RETIREMENT_COACH_PROMPT).total_tokens}")
+
+if __name__ == "__main__":
+    main()
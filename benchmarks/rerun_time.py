@@ -0,0 +1,118 @@
+"""Streamlit rerun cost against transcript length.
+
+Usage:
+    python benchmarks/rerun_time.py [--lengths 0,50,100,200,400] [--repeats 5] [--json]
+
+For each transcript length the app is seeded with that many messages and timed
+through AppTest in two ways:
+
+full       a full-app rerun (page chrome, sidebar, whole transcript, chat fragment),
+           what every interaction used to cost.
+unbounded  a rerun of render_chat() alone when every message was typed in this
+           session since the last full rerun: the fragment redraws all of them.
+fragment   the same rerun with the tail app.py actually lets build up (at most
+           FRAGMENT_MAX_MESSAGES before a full rerun resets it), i.e. what sending
+           a message costs now.
+
+Elements counts the chat messages each kind of rerun sends to the browser.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("RETIRECHAT_BACKEND", "mock")
+os.environ.setdefault("RETIRECHAT_METRICS_PORT", "0")
+os.environ.setdefault("RETIRECHAT_CONVERSATION_DB", "")
+
+from streamlit.testing.v1 import AppTest
+
+from app import FRAGMENT_MAX_MESSAGES
+from chat_engine import ChatSession
+
+SAMPLE_TURN = (
+    ("user", "I'm 45, I have about $120,000 in my 401(k) and I'd like to retire at 63."),
+    ("assistant", "Thanks for sharing that. **A good first step** is to confirm how much you contribute "
+                  "to your employer's plan, and whether you capture the full match.\n\n"
+                  "- Increase your savings rate by 1% a year\n- Build an emergency fund\n"
+                  "- Review your investment mix annually"),
+)
+
+
+def chat_fragment_script(root):
+    import sys
+    sys.path.insert(0, root)
+    import app
+    app.render_chat()
+
+
+def seeded_state(at, length, rendered_upto):
+    chat = ChatSession()
+    chat.conversation.max_messages = 0
+    for index in range(length):
+        chat.conversation.append(*SAMPLE_TURN[index % 2])
+    at.session_state["chat"] = chat
+    # Messages before rendered_upto were drawn by the last full-app rerun; the fragment redraws the rest
+    at.session_state["rendered_upto"] = rendered_upto
+    return at
+
+
+def time_reruns(at, repeats):
+    at.run()  # warm-up: imports, cache_resource singletons
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        at.run()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), len(at.chat_message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lengths", default="0,50,100,200,400", help="comma-separated transcript lengths")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    rows = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for length in [int(value) for value in args.lengths.split(",")]:
+            full = seeded_state(AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120), length, 0)
+            unbounded = seeded_state(
+                AppTest.from_function(chat_fragment_script, args=(ROOT,), default_timeout=120), length, 0
+            )
+            fragment = seeded_state(
+                AppTest.from_function(chat_fragment_script, args=(ROOT,), default_timeout=120),
+                length, max(0, length - FRAGMENT_MAX_MESSAGES)
+            )
+            full_seconds, full_elements = time_reruns(full, args.repeats)
+            unbounded_seconds, unbounded_elements = time_reruns(unbounded, args.repeats)
+            fragment_seconds, fragment_elements = time_reruns(fragment, args.repeats)
+            rows.append({
+                "messages": length,
+                "full_rerun_ms": round(full_seconds * 1000, 2),
+                "full_elements": full_elements,
+                "unbounded_rerun_ms": round(unbounded_seconds * 1000, 2),
+                "unbounded_elements": unbounded_elements,
+                "fragment_rerun_ms": round(fragment_seconds * 1000, 2),
+                "fragment_elements": fragment_elements,
+            })
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    columns = list(rows[0]) if rows else []
+    print("  ".join(f"{column:>18}" for column in columns))
+    for row in rows:
+        print("  ".join(f"{row[column]:>18}" for column in columns))
+
+
+if __name__ == "__main__":
+    main()
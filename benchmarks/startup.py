@@ -0,0 +1,106 @@
+"""Cold-start cost: import time, first render and time to first response.
+
+Usage:
+    python benchmarks/startup.py [--runs 3] [--think-seconds 2] [--json]
+
+Every measurement runs in a fresh interpreter so nothing is already imported:
+
+imports         wall time of importing each heavy dependency on its own
+first_render    first AppTest run of app.py, i.e. what a new instance does before
+                the page appears
+first_response  first chat turn after first_render and a pause of --think-seconds
+                (a user reading the page), with the background warm-up on and off
+
+Uses the mock backend unless RETIRECHAT_BACKEND is set; the mock imports the Gemini
+SDK for its types, so SDK import and client setup are still part of the numbers.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["streamlit", "google.generativeai", "google.api_core.exceptions", "dotenv"]
+
+
+def child_env(**overrides):
+    env = dict(os.environ)
+    env.setdefault("RETIRECHAT_BACKEND", "mock")
+    env.setdefault("RETIRECHAT_METRICS_PORT", "0")
+    env.setdefault("RETIRECHAT_CONVERSATION_DB", "")
+    env.setdefault("RETIRECHAT_MOCK_SEED", "7")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    env.update(overrides)
+    return env
+
+
+def run_child(code, env):
+    """Run code in a fresh interpreter; it prints one JSON object on its last line"""
+    with tempfile.TemporaryDirectory() as cwd:
+        result = subprocess.run(
+            [sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, check=True
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_import(module):
+    code = (
+        "import json, time\n"
+        "started = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(json.dumps({'seconds': time.perf_counter() - started}))\n"
+    )
+    return run_child(code, child_env())["seconds"]
+
+
+def measure_first_response(warmup, think_seconds):
+    code = (
+        "import contextlib, io, json, os, time\n"
+        "from streamlit.testing.v1 import AppTest\n"
+        "script = os.path.join(os.environ['PYTHONPATH'].split(os.pathsep)[0], 'app.py')\n"
+        "with contextlib.redirect_stdout(io.StringIO()):\n"
+        "    started = time.perf_counter()\n"
+        "    at = AppTest.from_file(script, default_timeout=120).run()\n"
+        "    first_render = time.perf_counter() - started\n"
+        f"    time.sleep({think_seconds})\n"
+        "    started = time.perf_counter()\n"
+        "    at.chat_input[0].set_value('Where should I start with retirement planning?').run()\n"
+        "    first_response = time.perf_counter() - started\n"
+        "print(json.dumps({'first_render': first_render, 'first_response': first_response}))\n"
+    )
+    return run_child(code, child_env(RETIRECHAT_WARMUP="true" if warmup else "false"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--think-seconds", type=float, default=2.0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = {"imports": {}, "first_render": {}, "first_response": {}}
+    for module in MODULES:
+        report["imports"][module] = round(statistics.median(measure_import(module) for _ in range(args.runs)), 4)
+
+    for warmup in (False, True):
+        label = "warmup" if warmup else "no_warmup"
+        runs = [measure_first_response(warmup, args.think_seconds) for _ in range(args.runs)]
+        report["first_render"][label] = round(statistics.median(run["first_render"] for run in runs), 4)
+        report["first_response"][label] = round(statistics.median(run["first_response"] for run in runs), 4)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for section, values in report.items():
+        print(section)
+        for key, value in values.items():
+            print(f"  {key:>28}: {value}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""Headless HTTP API for the chat engine, streaming answers as Server-Sent Events.
+
+Usage:
+    uvicorn chat_api:app --host 0.0.0.0 --port 8000
+    python chat_api.py [--host 0.0.0.0] [--port 8000]
+
+Endpoints:
+    POST   /v1/sessions                     start a session -> {"session_id"}
+    GET    /v1/sessions/{id}/messages       transcript page, ?start=&limit= (newest page by default)
+    POST   /v1/sessions/{id}/messages       {"content": "..."}; an SSE stream when the request
+                                            accepts text/event-stream, otherwise one JSON reply
+    DELETE /v1/sessions/{id}                clear the conversation
+    POST   /v1/sessions/{id}/plan           start (or reuse) the Plan of Action export
+    GET    /v1/sessions/{id}/plan           export status
+    GET    /v1/sessions/{id}/plan.{format}  finished export as md, html or pdf
+    POST   /v1/chat                         stateless turn: {"message", "history"} -> {"response"}
+    GET    /healthz, /metrics, /metrics.json
+
+Stream events: queue {"position", "expected_seconds"} while waiting for capacity,
+text {"text"} per chunk, then done {"index", "content"} once the turn is recorded,
+or cancelled {} when a newer message from the same session superseded it.
+
+The response to a streaming request is written from the event loop. The turn itself
+runs on an upstream producer thread, which waits in the admission queue while
+capacity is short, plus a stream reader thread once admitted. Each turn in progress,
+queued or not, therefore holds one or two threads. An idle session holds none, and
+/v1/chat holds a threadpool slot for its whole turn. Sessions are the same
+ChatSession objects the Streamlit app uses; with the conversation store enabled
+they resume on any instance.
+"""
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import chat_engine
+import metrics
+import plan_export
+
+# Live sessions kept in memory; older ones are dropped and resumed from the store when they return
+MAX_SESSIONS = int(os.getenv("RETIRECHAT_API_MAX_SESSIONS", "1000"))
+MAX_MESSAGE_CHARS = int(os.getenv("RETIRECHAT_API_MAX_MESSAGE_CHARS", "8000"))
+MAX_PAGE_SIZE = 200
+
+class SessionCache:
+    """Least recently used ChatSessions by id"""
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """The live session, resuming it from the conversation store if it isn't in memory"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                return session
+        session = chat_engine.ChatSession(session_id)
+        with self._lock:
+            # Another request may have resumed it meanwhile; keep the first one
+            session = self._sessions.setdefault(session_id, session)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+SESSIONS = SessionCache()
+metrics.REGISTRY.gauge("retirechat_api_sessions", "Chat sessions held in memory by the API", lambda: len(SESSIONS))
+
+
+class BadRequest(Exception):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+def error(status, message):
+    return JSONResponse({"error": message}, status_code=status)
+
+
+async def read_json(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise BadRequest("request body must be JSON")
+    if not isinstance(body, dict):
+        raise BadRequest("request body must be a JSON object")
+    return body
+
+
+def message_text(body, field):
+    text = body.get(field)
+    if not isinstance(text, str) or not text.strip():
+        raise BadRequest(f"'{field}' must be a non-empty string")
+    if len(text) > MAX_MESSAGE_CHARS:
+        raise BadRequest(f"'{field}' is longer than {MAX_MESSAGE_CHARS} characters")
+    return text.strip()
+
+
+async def session_for(request):
+    session_id = chat_engine.issued_session_id(request.path_params["session_id"])
+    if session_id is None:
+        # Ids are only ever issued by POST /v1/sessions; anything else is treated as unknown
+        raise NotFound("no such session")
+    # Resuming reads the conversation store
+    return await run_in_threadpool(SESSIONS.get, session_id)
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def job_status(job):
+    status = {"status": job.status, "progress": round(job.progress, 3), "stage": job.stage, "version": job.version}
+    if job.status == "done":
+        status["formats"] = sorted(job.artifacts)
+    if job.error:
+        status["error"] = job.error
+    return status
+
+
+async def create_session(request):
+    session = await run_in_threadpool(SESSIONS.get, chat_engine.new_session_id())
+    return JSONResponse({"session_id": session.session_id}, status_code=201)
+
+
+async def list_messages(request):
+    session = await session_for(request)
+    conversation = session.conversation
+    try:
+        limit = int(request.query_params.get("limit", 50))
+        start = int(request.query_params.get("start", max(0, len(conversation) - limit)))
+    except ValueError:
+        raise BadRequest("start and limit must be integers")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise BadRequest(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    if start < 0:
+        raise BadRequest("start must not be negative")
+    messages = await run_in_threadpool(conversation.page, start, start + limit)
+    return JSONResponse({
+        "session_id": session.session_id,
+        "total": len(conversation),
+        "start": start,
+        "messages": [dict(message.to_dict(), index=start + i) for i, message in enumerate(messages)],
+    })
+
+
+async def post_message(request):
+    session = await session_for(request)
+    content = message_text(await read_json(request), "content")
+
+    if "text/event-stream" in request.headers.get("accept", ""):
+        async def events():
+            async for event, data in session.reply_events(content):
+                yield sse(event, {"text": data} if event == "text" else data)
+        return StreamingResponse(
+            events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    async for event, data in session.reply_events(content):
+        if event == "done":
+            return JSONResponse(data)
+    return error(409, "superseded by a newer message in this session")
+
+
+async def clear_session(request):
+    session = await session_for(request)
+    await run_in_threadpool(session.clear)
+    return Response(status_code=204)
+
+
+async def start_export(request):
+    session = await session_for(request)
+    job = await run_in_threadpool(session.export_plan)
+    if job is None:
+        return error(409, "the conversation is empty")
+    return JSONResponse(job_status(job), status_code=202 if job.active else 200)
+
+
+async def export_status(request):
+    session = await session_for(request)
+    job = session.latest_export()
+    if job is None:
+        return error(404, "no export for this session")
+    return JSONResponse(job_status(job))
+
+
+async def download_export(request):
+    session = await session_for(request)
+    fmt = request.path_params["format"]
+    if fmt not in plan_export.FORMATS:
+        return error(404, f"unknown format {fmt}")
+    job = session.latest_export()
+    if job is None or job.status != "done":
+        return error(404, "no finished export for this session")
+    return Response(
+        job.artifacts[fmt],
+        media_type=plan_export.FORMATS[fmt][1],
+        headers={"Content-Disposition": f'attachment; filename="plan-of-action.{fmt}"'}
+    )
+
+
+async def stateless_chat(request):
+    body = await read_json(request)
+    message = message_text(body, "message")
+    history = body.get("history") or []
+    if not isinstance(history, list) or not all(
+        isinstance(msg, dict) and msg.get("role") in ("user", "assistant") and isinstance(msg.get("content"), str)
+        for msg in history
+    ):
+        raise BadRequest("'history' must be a list of {role: user|assistant, content} objects")
+    response = await run_in_threadpool(chat_engine.get_ai_response, message, history)
+    return JSONResponse({"response": response})
+
+
+async def health(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def metrics_text(request):
+    return Response(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+async def metrics_json(request):
+    return Response(json.dumps(metrics.REGISTRY.snapshot(), default=str), media_type="application/json")
+
+
+async def bad_request(request, exc):
+    return error(400, str(exc))
+
+
+async def not_found(request, exc):
+    return error(404, str(exc))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    chat_engine.start_warmup()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/v1/sessions", create_session, methods=["POST"]),
+        Route("/v1/sessions/{session_id}", clear_session, methods=["DELETE"]),
+        Route("/v1/sessions/{session_id}/messages", list_messages, methods=["GET"]),
+        Route("/v1/sessions/{session_id}/messages", post_message, methods=["POST"]),
+        Route("/v1/sessions/{session_id}/plan", start_export, methods=["POST"]),
+        Route("/v1/sessions/{session_id}/plan", export_status, methods=["GET"]),
+        Route("/v1/sessions/{session_id}/plan.{format}", download_export, methods=["GET"]),
+        Route("/v1/chat", stateless_chat, methods=["POST"]),
+        Route("/healthz", health),
+        Route("/metrics", metrics_text),
+        Route("/metrics.json", metrics_json),
+    ],
+    exception_handlers={BadRequest: bad_request, NotFound: not_found},
+    lifespan=lifespan,
+)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1738 @@
+"""RetireChat chat engine: everything between a user message and the coach's answer.
+
+Prompting, the Gemini client pool, admission control, retries and hedging,
+streaming with tool calls, knowledge retrieval, the canned fallbacks and the Plan
+of Action export live here without any UI code, so the Streamlit app (app.py) and
+the HTTP API (chat_api.py) are thin clients of the same engine. Shared resources
+are created once per process, on first use.
+"""
+import os
+from dotenv import load_dotenv
+import time
+import re
+import threading
+import asyncio
+import random
+import datetime
+import functools
+import collections
+import concurrent.futures
+import uuid
+import queue
+import hmac
+import hashlib
+import secrets
+
+from google.api_core import exceptions as google_exceptions
+
+import knowledge_index
+import metrics
+import plan_export
+from conversation_store import ConversationStore, SQLiteConversationBackend
+from inflight import InflightRegistry
+from metrics import STAGE_SECONDS, TurnMetrics, log_event
+from rate_limiter import AdmissionCancelled, AdmissionController, AdmissionTimeout
+from response_cache import ResponseCache
+from retirement_projection import PROJECT_RETIREMENT_TOOL, project_retirement
+
+load_dotenv()
+
+MODEL_NAME = 'gemini-2.5-flash'
+
+# "gemini" calls the live API; "mock" uses the offline stand-in from mock_backend.py
+BACKEND = os.getenv("RETIRECHAT_BACKEND", "gemini")
+
+# Build the client, open its connections and prime the context cache in the background
+# when the app or API starts, instead of during the first user request
+WARMUP_ON_START = os.getenv("RETIRECHAT_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# Let Gemini call the local Monte Carlo projection for savings and readiness questions
+TOOLS_ENABLED = os.getenv("RETIRECHAT_TOOLS", "true").lower() in ("1", "true", "yes")
+MAX_TOOL_ROUNDS = int(os.getenv("RETIRECHAT_MAX_TOOL_ROUNDS", "2"))
+
+# Local BM25 index over the knowledge sources (built with knowledge_index.py); the
+# best-matching snippets are added to each request together with their source links
+KNOWLEDGE_INDEX_PATH = os.getenv("RETIRECHAT_KNOWLEDGE_INDEX", os.path.join("knowledge", "index"))
+KNOWLEDGE_TOP_K = int(os.getenv("RETIRECHAT_KNOWLEDGE_TOP_K", "3"))
+KNOWLEDGE_MIN_SCORE = float(os.getenv("RETIRECHAT_KNOWLEDGE_MIN_SCORE", "2.0"))
+
+# Plan of Action export: runs on its own worker pool with a larger output budget
+EXPORT_WORKERS = int(os.getenv("RETIRECHAT_EXPORT_WORKERS", "2"))
+PLAN_MAX_OUTPUT_TOKENS = int(os.getenv("RETIRECHAT_PLAN_MAX_TOKENS", "4096"))
+PLAN_HISTORY_TOKEN_BUDGET = int(os.getenv("RETIRECHAT_PLAN_HISTORY_TOKENS", "8000"))
+# Writing the plan may take longer than a chat turn; past this the plan is assembled locally
+PLAN_DEADLINE_SECONDS = float(os.getenv("RETIRECHAT_PLAN_DEADLINE", "120"))
+
+# "system" sends the coach prompt as system_instruction with structured turns,
+# "inline" glues prompt, history and input into a single string
+PROMPT_MODE = os.getenv("RETIRECHAT_PROMPT_MODE", "system")
+
+# Optional server-side caching of the coach prompt (system mode only)
+USE_CONTEXT_CACHE = os.getenv("RETIRECHAT_CONTEXT_CACHE", "false").lower() in ("1", "true", "yes")
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("RETIRECHAT_CONTEXT_CACHE_TTL", "3600"))
+
+# Token budget for conversation history; older turns are folded into a rolling summary
+HISTORY_TOKEN_BUDGET = int(os.getenv("RETIRECHAT_HISTORY_TOKEN_BUDGET", "2000"))
+# "local" estimates tokens from text length, "api" uses the SDK's count_tokens
+TOKEN_COUNTER = os.getenv("RETIRECHAT_TOKEN_COUNTER", "local")
+
+# Shared response cache for identical requests (e.g. Quick Start prompts on a fresh conversation)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RETIRECHAT_RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RETIRECHAT_RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_PATH = os.getenv("RETIRECHAT_RESPONSE_CACHE_PATH")  # optional SQLite file
+# Only cache turns with at most this many prior messages, so personal conversations stay uncached
+RESPONSE_CACHE_MAX_HISTORY = int(os.getenv("RETIRECHAT_RESPONSE_CACHE_MAX_HISTORY", "0"))
+
+# Attempt scheduling: overall budget per turn, timeout per model call, and hedging
+TURN_DEADLINE_SECONDS = float(os.getenv("RETIRECHAT_TURN_DEADLINE", "30"))
+ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("RETIRECHAT_ATTEMPT_TIMEOUT", "15"))
+# A stream that stalls before its first chunk, or between chunks, for longer than this is abandoned
+STREAM_FIRST_CHUNK_TIMEOUT_SECONDS = float(os.getenv("RETIRECHAT_STREAM_FIRST_CHUNK_TIMEOUT", "10"))
+STREAM_CHUNK_TIMEOUT_SECONDS = float(os.getenv("RETIRECHAT_STREAM_CHUNK_TIMEOUT", "10"))
+HEDGING_ENABLED = os.getenv("RETIRECHAT_HEDGING", "true").lower() in ("1", "true", "yes")
+# Hedge delay used until enough latencies are observed to estimate p90
+DEFAULT_HEDGE_DELAY_SECONDS = float(os.getenv("RETIRECHAT_HEDGE_DELAY", "6"))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+
+# Process-wide admission control in front of every Gemini call
+MAX_IN_FLIGHT_CALLS = int(os.getenv("RETIRECHAT_MAX_IN_FLIGHT", "16"))
+REQUESTS_PER_MINUTE = int(os.getenv("RETIRECHAT_RPM", "600"))
+TOKENS_PER_MINUTE = int(os.getenv("RETIRECHAT_TPM", "1000000"))
+
+# Prometheus-style metrics endpoint (/metrics and /metrics.json); 0 disables it
+METRICS_PORT = int(os.getenv("RETIRECHAT_METRICS_PORT", "9464"))
+
+# Per-session transcript retention; older messages are folded into the summary and
+# optionally spilled to RETIRECHAT_SPILL_DIR as JSON lines
+MAX_SESSION_MESSAGES = int(os.getenv("RETIRECHAT_MAX_SESSION_MESSAGES", "200"))
+SPILL_DIR = os.getenv("RETIRECHAT_SPILL_DIR")
+
+# Durable transcripts (SQLite, WAL mode) so a session can resume on any instance; empty disables.
+# Off by default on Cloud Run (K_SERVICE is set there), where the local disk is held in memory
+CONVERSATION_DB_PATH = os.getenv("RETIRECHAT_CONVERSATION_DB", "" if os.getenv("K_SERVICE") else "conversations.db")
+# Sessions idle for longer than this are deleted from the store; 0 keeps them forever
+CONVERSATION_RETENTION_DAYS = float(os.getenv("RETIRECHAT_CONVERSATION_RETENTION_DAYS", "30"))
+
+# Session ids are signed so only ids this deployment issued can be resumed; instances that
+# share a conversation store must share the secret (a per-process one is used when unset)
+SESSION_SECRET = os.getenv("RETIRECHAT_SESSION_SECRET") or secrets.token_hex(32)
+SESSION_ID = re.compile(r"[0-9a-f]{32}-[0-9a-f]{16}")
+
+RETIREMENT_COACH_PROMPT = """
+You are an expert Retirement Planning Coach providing personalized retirement planning suggestions.
+
+Goals:
+* Getting to know the user: Start by asking about their current age and what stage of their career they are in (early career, mid-career, late career, near retirement, etc.). This helps personalize all advice.
+* Understand the user's current retirement plan: use available data to learn about their plan. Tailor advice based on this information. Ask the user to describe their plan, savings, challenges, and debt.
+* Identify retirement goals: ask about short-term and long-term goals. What age of retirement are they planning for? How much do they want to have saved at time of retirement?
+* Assess skills and gaps: evaluate current skills and identify gaps to achieve career goals to achieve their priorities.
+* Suggest learning opportunities: recommend courses, certifications, workshops, or other learning opportunities to acquire necessary skills.
+* Create a plan of action: develop a step-by-step plan with actions, timelines, and milestone. If asked for a detailed plan, include immediate actions, next 3 months, next 6 months, next 1-2 years, and ongoing.
+* Plan finalization: Once user expresses satisfaction in plan, ask the user if they wish the AI to create a printable professional document outlining their Plan of Action.
+
+Overall direction:
+* Make responses relevant to the user's current or desired plan
+* Avoid overwhelming the user with multiple questions at one
+* Ask clarifying and follow-up questions
+* Be encouraging and maintain a professional, supportive tone
+* Keep context across the conversation, ensuring ideas and responses relate to previous turns
+* After each subtopic, ask if the user has follow-up questions or needs further help
+* If greeted or asked what you can do, briefly explain your purpose with concise examples, then ask about their age and career stage to personalize your advice
+* If asked unrelated questions, answer but try to refocus on retirement planning, financial wellness, and financial 101 questions.
+* For savings targets, "am I on track" or retirement-age questions, call the project_retirement tool with the user's numbers instead of estimating them yourself, then explain its results in plain language
+* If asked about what certain plans are and their definition, or if you pull any information from a source, make sure it is credible and to have a little source link so that they can verify that your information is certifiable and correct
+* At the end of each conversation, ask how you did and encourage feedback using the thumbs up or down.
+
+Knowledge:
+Https://2025-benefits.segalco.com/
+Https://www.psca.org/news/psca-news/
+When reference snippets from these sources are included with a question, base your answer on them and cite the source link of each snippet you use.
+"""
+
+PLAN_REQUEST = """
+Write my printable Plan of Action document based on everything we have discussed, formatted in Markdown.
+Use these sections as ## headings: Summary of Your Situation, Retirement Goals, Immediate Actions, Next 3 Months,
+Next 6 Months, Next 1-2 Years, Ongoing Habits, Learning Opportunities, Resources.
+Use bullet lists with concrete actions, amounts and dates where we discussed them, and include source links under Resources.
+Output only the document: no greeting, no questions and no closing remarks.
+"""
+
+# Functions Gemini may call, by name
+TOOL_FUNCTIONS = {
+    "project_retirement": project_retirement,
+}
+
+def process_singleton(factory):
+    """Build factory() once per process on first call and share it from then on.
+
+    The engine's stand-in for st.cache_resource: it works from any thread and
+    without a Streamlit runtime, so the API server and worker threads share the
+    same resources as the app.
+    """
+    instance = []
+    lock = threading.Lock()
+
+    @functools.wraps(factory)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+    return get
+
+_genai = None
+_genai_lock = threading.Lock()
+
+def load_genai():
+    """Import and configure the Gemini SDK on first use rather than at startup (~1s of imports)"""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                started = time.perf_counter()
+                import google.generativeai as genai
+                genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="sdk_import")
+                _genai = genai
+    return _genai
+
+def sanitize_input(user_input):
+    """Sanitize user input to avoid triggering safety filters"""
+    # Remove potentially problematic phrases that might trigger safety filters
+    sanitized = user_input
+    
+    # Replace common financial terms that might trigger filters
+    replacements = {
+        r'\bdebts?\b': 'financial obligations',
+        r'\bbankrupt(cy)?\b': 'financial restructuring',
+        r'\bfail(ed|ure)?\b': 'challenging situation',
+        r'\bcrisis\b': 'difficult period',
+        r'\bstrug(gle|gling)\b': 'working through challenges',
+        r'\bdesperate\b': 'urgently seeking',
+        r'\bpoor\b': 'limited financial resources',
+        r'\bbroke\b': 'financially constrained'
+    }
+    
+    for pattern, replacement in replacements.items():
+        sanitized = re.sub(pattern, replacement, sanitized, flags=re.IGNORECASE)
+    
+    return sanitized
+
+def prepare_attempt_input(user_input, attempt):
+    """Rewrite the user input for a given retry strategy"""
+    if attempt == 0:
+        # First attempt: Use original input with most permissive settings
+        return user_input
+    elif attempt == 1:
+        # Second attempt: Use sanitized input
+        return sanitize_input(user_input)
+    else:
+        # Third attempt: Rephrase as a professional consultation
+        return f"As a retirement planning professional, please provide guidance on: {sanitize_input(user_input)}"
+
+# Rate limiting and server-side failures are worth retrying after a backoff
+TRANSIENT_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+)
+
+class StreamTimeout(TimeoutError):
+    pass
+
+class TimedStream:
+    """Chunks of a blocking model stream, read on a helper thread so a stalled stream can time out.
+    
+    open_stream() runs on the helper thread (the SDK already waits for the first chunk
+    inside generate_content). Iterating raises StreamTimeout when the first chunk or the
+    next one is late, or the deadline (a time.perf_counter() value) passes; the helper is
+    then left to the request's own timeout. response is set once the stream has opened.
+    """
+    
+    def __init__(self, open_stream, deadline, first_chunk_timeout=STREAM_FIRST_CHUNK_TIMEOUT_SECONDS,
+                 chunk_timeout=STREAM_CHUNK_TIMEOUT_SECONDS):
+        self.response = None
+        self.deadline = deadline
+        self.first_chunk_timeout = first_chunk_timeout
+        self.chunk_timeout = chunk_timeout
+        self._items = queue.Queue()
+        threading.Thread(target=self._read, args=(open_stream,), name="gemini-stream", daemon=True).start()
+    
+    def _read(self, open_stream):
+        try:
+            response = open_stream()
+            self._items.put(("response", response))
+            for chunk in response:
+                self._items.put(("chunk", chunk))
+            self._items.put(("end", None))
+        except Exception as e:
+            self._items.put(("error", e))
+    
+    def __iter__(self):
+        first = True
+        while True:
+            wait = max(0.0, min(
+                self.first_chunk_timeout if first else self.chunk_timeout,
+                self.deadline - time.perf_counter()
+            ))
+            try:
+                kind, value = self._items.get(timeout=wait)
+            except queue.Empty:
+                raise StreamTimeout(f"no {'first' if first else 'next'} chunk within {wait:.1f}s")
+            if kind == "response":
+                self.response = value
+            elif kind == "chunk":
+                first = False
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                return
+
+def backoff_delay(failures):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** failures)))
+
+class LatencyTracker:
+    """Rolling window of successful attempt latencies used to pick the hedge delay"""
+    
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+    
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+    
+    def percentile(self, fraction, default):
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return default
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+@process_singleton
+def get_latency_tracker():
+    """Single latency tracker per server process"""
+    tracker = LatencyTracker()
+    metrics.REGISTRY.gauge(
+        "retirechat_hedge_delay_seconds", "Current hedge delay (observed p90 attempt latency)",
+        lambda: tracker.percentile(0.9, DEFAULT_HEDGE_DELAY_SECONDS)
+    )
+    return tracker
+
+class AsyncRunner:
+    """Long-lived event loop on a background thread shared by all sessions.
+    
+    The async Gemini transport is bound to the loop it was first used on, so every
+    coroutine runs on this one loop instead of a fresh asyncio.run() per turn.
+    """
+    
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="gemini-async", daemon=True)
+        self._thread.start()
+    
+    def submit(self, coro):
+        """Schedule a coroutine and return a concurrent.futures.Future for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def run(self, coro):
+        return self.submit(coro).result()
+
+@process_singleton
+def get_async_runner():
+    """Single event loop thread per server process"""
+    return AsyncRunner()
+
+async def get_ai_response_with_retry_async(user_input, conversation_history, max_retries=3, first_attempt=0,
+                                           pool=None, tracker=None, admission=None, on_queue=None, turn=None,
+                                           time_budget=None):
+    """Race retry strategies within a turn deadline; the first usable response wins.
+    
+    A strategy that fails moves straight on to the next one, transient 429/5xx errors
+    retry the same strategy after a jittered backoff, and a slow attempt is hedged
+    with the next strategy once it passes the observed p90 latency. The shared pool,
+    tracker and admission controller can be passed in when the caller already holds them;
+    time_budget replaces the turn deadline when part of the turn has already been spent.
+    Hedge delays and recorded latencies count from admission, so time spent queued for
+    capacity neither triggers a hedge nor inflates the p90.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (TURN_DEADLINE_SECONDS if time_budget is None else time_budget)
+    pool = pool or get_client_pool()
+    tracker = tracker or get_latency_tracker()
+    admission = admission or get_admission_controller()
+    pending = {}  # task -> {"attempt", "admitted"}; admitted is the loop time admission was granted
+    retry_queue = []
+    launches_left = max_retries - first_attempt
+    next_attempt = first_attempt
+    transient_failures = 0
+    launch_at = loop.time()  # next scheduled launch (first attempt, backoff or failover); hedges aren't scheduled
+    
+    def hedge_time():
+        """When to hedge the newest attempt, or None when there is nothing (yet) to hedge"""
+        if not HEDGING_ENABLED or not pending:
+            return None
+        admitted = [slot["admitted"] for slot in pending.values()]
+        if None in admitted:
+            # Still queued for capacity; a hedge would only queue behind it
+            return None
+        return max(admitted) + tracker.percentile(0.9, DEFAULT_HEDGE_DELAY_SECONDS)
+    
+    try:
+        while pending or (launch_at is not None and launches_left > 0):
+            now = loop.time()
+            if now >= deadline:
+                log_event("turn_deadline_reached", deadline_seconds=TURN_DEADLINE_SECONDS)
+                break
+            
+            if launch_at is None:
+                hedge_at = hedge_time()
+                if hedge_at is not None and now >= hedge_at:
+                    launch_at = now
+            
+            if launch_at is not None and now >= launch_at and launches_left > 0:
+                if retry_queue:
+                    attempt = retry_queue.pop(0)
+                else:
+                    attempt = min(next_attempt, max_retries - 1)
+                    next_attempt += 1
+                launches_left -= 1
+                slot = {"attempt": attempt, "admitted": None}
+                task = asyncio.ensure_future(get_ai_response_attempt(
+                    prepare_attempt_input(user_input, attempt),
+                    conversation_history,
+                    attempt,
+                    pool=pool,
+                    admission=admission,
+                    on_queue=on_queue,
+                    on_admitted=lambda slot=slot: slot.update(admitted=loop.time()),
+                    timeout=min(ATTEMPT_TIMEOUT_SECONDS, deadline - now),
+                    turn=turn
+                ))
+                pending[task] = slot
+                launch_at = None
+            
+            wait = deadline - now
+            if launches_left > 0:
+                if launch_at is not None:
+                    wait = min(wait, max(0.0, launch_at - now))
+                elif HEDGING_ENABLED and pending:
+                    hedge_at = hedge_time()
+                    if hedge_at is None:
+                        # An attempt is still queued; its hedge is at least a full delay away
+                        hedge_at = now + tracker.percentile(0.9, DEFAULT_HEDGE_DELAY_SECONDS)
+                    wait = min(wait, max(0.0, hedge_at - now))
+            if not pending:
+                await asyncio.sleep(wait)
+                continue
+            
+            done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                slot = pending.pop(task)
+                attempt = slot["attempt"]
+                try:
+                    response = task.result()
+                except TRANSIENT_ERRORS as e:
+                    delay = backoff_delay(transient_failures)
+                    transient_failures += 1
+                    log_event(
+                        "attempt_retry",
+                        attempt=attempt,
+                        backoff_seconds=round(delay, 3),
+                        error=str(e) or type(e).__name__
+                    )
+                    retry_queue.append(attempt)
+                    launch_at = loop.time() + delay
+                    continue
+                
+                if slot["admitted"] is not None:
+                    tracker.record(loop.time() - slot["admitted"])
+                if response and not response.startswith("I apologize"):
+                    return response
+                
+                # This strategy didn't produce a usable answer; try the next one right away
+                launch_at = loop.time()
+        
+        return None
+    finally:
+        # First success wins: cancel whatever is still running
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+def get_ai_response_with_retry(user_input, conversation_history, max_retries=3, first_attempt=0, on_queue=None,
+                               cancel_event=None, turn=None, time_budget=None):
+    """Get AI response with multiple retry strategies to bypass safety filters"""
+    # Queue updates arrive on the event loop thread; relay them from this thread
+    queue_state = {}
+    future = get_async_runner().submit(get_ai_response_with_retry_async(
+        user_input,
+        conversation_history,
+        max_retries,
+        first_attempt,
+        pool=get_client_pool(),
+        tracker=get_latency_tracker(),
+        admission=get_admission_controller(),
+        on_queue=lambda position, expected_seconds: queue_state.update(current=(position, expected_seconds)),
+        turn=turn,
+        time_budget=time_budget
+    ))
+    
+    shown = None
+    while True:
+        try:
+            response = future.result(timeout=0.25)
+            break
+        except concurrent.futures.TimeoutError:
+            if cancel_event is not None and cancel_event.is_set():
+                # Superseded by a newer request; cancels every attempt still running
+                future.cancel()
+                response = None
+                break
+            current = queue_state.get("current")
+            if on_queue and current is not None and current != shown:
+                on_queue(*current)
+                shown = current
+    if on_queue and shown is not None and shown[0]:
+        on_queue(0, 0.0)
+    
+    # If all attempts fail, return a helpful fallback response
+    return response or generate_fallback_response(user_input)
+
+def estimate_tokens(text):
+    """Rough local token estimate (about 4 characters per token for English)"""
+    return max(1, (len(text) + 3) // 4)
+
+@functools.lru_cache(maxsize=4096)
+def count_message_tokens(text):
+    """Token count for one message, cached so each message is only counted once"""
+    if TOKEN_COUNTER == "api":
+        try:
+            return get_client_pool().model("inline").count_tokens(text).total_tokens
+        except Exception as e:
+            log_event("count_tokens_error", error=str(e))
+    return estimate_tokens(text)
+
+class ConversationContext:
+    """Token-budgeted history window with a rolling summary of evicted turns"""
+    
+    MAX_GOALS = 5
+    MAX_TOPICS = 6
+    
+    def __init__(self, token_budget=HISTORY_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.summarized_count = 0  # messages already folded into the summary
+        self.facts = {}
+        self.goals = []
+        self.topics = []
+    
+    def reset(self):
+        self.summarized_count = 0
+        self.facts = {}
+        self.goals = []
+        self.topics = []
+    
+    def window(self, conversation_history):
+        """Newest messages that fit the budget, preceded by a summary message for older turns"""
+        if len(conversation_history) < self.summarized_count:
+            # History was cleared or replaced
+            self.reset()
+        
+        budget = self.token_budget - count_message_tokens(self.summary_text())
+        start = len(conversation_history)
+        used = 0
+        for index in range(len(conversation_history) - 1, self.summarized_count - 1, -1):
+            cost = count_message_tokens(conversation_history[index]["content"])
+            if used + cost > budget and start < len(conversation_history):
+                break
+            used += cost
+            start = index
+        
+        # Fold only the newly evicted turns; earlier ones are already in the summary
+        for msg in conversation_history[self.summarized_count:start]:
+            self.fold(msg)
+        self.summarized_count = max(self.summarized_count, start)
+        
+        window = list(conversation_history[start:])
+        summary = self.summary_text()
+        if summary:
+            window.insert(0, {"role": "summary", "content": summary})
+        return window
+    
+    def fold_evicted(self, index, msg):
+        """ConversationStore eviction hook: a message leaving memory must reach the summary first"""
+        if index >= self.summarized_count:
+            self.fold(msg)
+            self.summarized_count = index + 1
+    
+    def fold(self, msg):
+        """Merge one evicted message into the running summary"""
+        # Only the user's own statements carry facts worth keeping; coach replies can be regenerated
+        if msg["role"] != "user":
+            return
+        text = msg["content"]
+        
+        age = re.search(r"\b(?:i am|i'm|im|age)\s+(\d{2})\b|\b(\d{2})[- ]years?[- ]old\b", text, re.IGNORECASE)
+        if age:
+            self.facts["Age"] = age.group(1) or age.group(2)
+        
+        stage = re.search(r"\b(early|mid|late)[- ]career\b|\bnear(?:ing)? retirement\b", text, re.IGNORECASE)
+        if stage:
+            self.facts["Career stage"] = stage.group(0).lower()
+        
+        retire_age = re.search(r"\bretire\w*\s+(?:at|by)\s+(?:age\s+)?(\d{2})\b", text, re.IGNORECASE)
+        if retire_age:
+            self.facts["Target retirement age"] = retire_age.group(1)
+        
+        amounts = re.findall(r"\$\s?\d[\d,.]*\s?(?:k|m|million|thousand)?\b", text, re.IGNORECASE)
+        if amounts:
+            self.facts["Amounts mentioned"] = ", ".join(amounts[:3])
+        
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if s.strip()]
+        for sentence in sentences:
+            if re.search(r"\b(goal|want to|plan to|hope to|would like|i'd like)\b", sentence, re.IGNORECASE):
+                self.goals = (self.goals + [sentence[:150]])[-self.MAX_GOALS:]
+        if sentences:
+            self.topics = (self.topics + [sentences[0][:120]])[-self.MAX_TOPICS:]
+    
+    def summary_text(self):
+        if not (self.facts or self.goals or self.topics):
+            return ""
+        lines = ["Summary of earlier conversation:"]
+        lines.extend(f"- {key}: {value}" for key, value in self.facts.items())
+        lines.extend(f"- Goal: {goal}" for goal in self.goals)
+        if self.topics:
+            lines.append("- Earlier topics: " + "; ".join(self.topics))
+        return "\n".join(lines)
+
+def retrieve_knowledge(user_input):
+    """Top-k knowledge snippets for the question, or [] when no index has been built"""
+    index = knowledge_index.load_index(KNOWLEDGE_INDEX_PATH)
+    if index is None or KNOWLEDGE_TOP_K <= 0:
+        return []
+    started = time.perf_counter()
+    snippets = index.search(user_input, k=KNOWLEDGE_TOP_K, min_score=KNOWLEDGE_MIN_SCORE)
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="retrieval")
+    return snippets
+
+def format_knowledge(snippets):
+    lines = ["Reference material (cite the source link of anything you use):"]
+    for number, snippet in enumerate(snippets, 1):
+        lines.append(f"[{number}] {snippet['title']} ({snippet['url']})\n{snippet['text']}")
+    return "\n\n".join(lines)
+
+def build_inline_context(user_input, conversation_history, snippets=()):
+    """Build a single prompt string with the coach prompt, recent history and new input"""
+    lines = [RETIREMENT_COACH_PROMPT]
+    for msg in conversation_history:
+        if msg["role"] == "summary":
+            lines.append(f"\n{msg['content']}")
+    if snippets:
+        lines.append(f"\n{format_knowledge(snippets)}")
+    
+    lines.append("\nConversation History:")
+    for msg in conversation_history:
+        if msg["role"] == "summary":
+            continue
+        role = "User" if msg["role"] == "user" else "Assistant"
+        lines.append(f"{role}: {msg['content']}")
+    
+    lines.append(f"\nUser: {user_input}\nAssistant:")
+    return "\n".join(lines)
+
+def build_chat_contents(user_input, conversation_history, snippets=()):
+    """Build structured chat turns; the coach prompt travels as system_instruction"""
+    contents = []
+    for msg in conversation_history:
+        if msg["role"] == "summary":
+            contents.append({"role": "user", "parts": [f"(Context from earlier in our conversation)\n{msg['content']}"]})
+            continue
+        role = "user" if msg["role"] == "user" else "model"
+        contents.append({"role": role, "parts": [msg["content"]]})
+    
+    if snippets:
+        contents.append({"role": "user", "parts": [format_knowledge(snippets), user_input]})
+    else:
+        contents.append({"role": "user", "parts": [user_input]})
+    return contents
+
+def build_context(user_input, conversation_history, mode=None, snippets=()):
+    """Build the model input for the configured prompt mode"""
+    if (mode or PROMPT_MODE) == "inline":
+        return build_inline_context(user_input, conversation_history, snippets)
+    return build_chat_contents(user_input, conversation_history, snippets)
+
+# Most permissive safety settings possible
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH", 
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_NONE"
+    }
+]
+
+def build_generation_config(attempt_number):
+    """Generation config for a given attempt, more conservative on each retry"""
+    genai = load_genai()
+    if attempt_number == 0:
+        return genai.types.GenerationConfig(
+            max_output_tokens=1000,
+            temperature=0.7,
+            top_p=0.9,
+            top_k=40
+        )
+    elif attempt_number == 1:
+        return genai.types.GenerationConfig(
+            max_output_tokens=800,
+            temperature=0.5,
+            top_p=0.8,
+            top_k=30
+        )
+    else:
+        return genai.types.GenerationConfig(
+            max_output_tokens=600,
+            temperature=0.3,
+            top_p=0.7,
+            top_k=20
+        )
+
+class GeminiClientPool:
+    """Process-wide model handles and generation configs shared by all sessions and reruns"""
+    
+    def __init__(self, model_name=MODEL_NAME, max_attempts=3, backend=BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self.safety_settings = SAFETY_SETTINGS
+        self.tools = [PROJECT_RETIREMENT_TOOL] if TOOLS_ENABLED else None
+        self.max_attempts = max_attempts
+        self._generation_configs = None
+        self._models = {}
+        self._lock = threading.Lock()
+        self._cached_model = None
+        self._cached_model_expires = 0.0
+        self._context_cache_failed = False
+        self._setup_calls = 0
+        self._setup_seconds = 0.0
+        self._setup_max_seconds = 0.0
+    
+    def model(self, mode=None):
+        """Shared model handle; its transport is created on first use and then reused"""
+        mode = mode or PROMPT_MODE
+        if mode != "inline" and USE_CONTEXT_CACHE and self.backend == "gemini":
+            model = self.context_cached_model()
+            if model is not None:
+                return model
+        
+        model = self._models.get(mode)
+        if model is None:
+            with self._lock:
+                model = self._models.get(mode)
+                if model is None:
+                    model = self.create_model(mode)
+                    self._models[mode] = model
+        return model
+    
+    def create_model(self, mode):
+        """Construct a model handle for the configured backend"""
+        if self.backend == "mock":
+            from mock_backend import MockGenerativeModel
+            return MockGenerativeModel.from_env(model_name=self.model_name)
+        
+        genai = load_genai()
+        if mode == "inline":
+            return genai.GenerativeModel(self.model_name, safety_settings=self.safety_settings, tools=self.tools)
+        return genai.GenerativeModel(
+            self.model_name,
+            safety_settings=self.safety_settings,
+            system_instruction=RETIREMENT_COACH_PROMPT,
+            tools=self.tools
+        )
+    
+    def context_cached_model(self):
+        """Model bound to a server-side cache of the coach prompt, recreated before it expires"""
+        if self._context_cache_failed:
+            return None
+        
+        if self._cached_model is not None and time.time() < self._cached_model_expires:
+            return self._cached_model
+        
+        with self._lock:
+            if self._cached_model is not None and time.time() < self._cached_model_expires:
+                return self._cached_model
+            
+            genai = load_genai()
+            try:
+                cached_content = genai.caching.CachedContent.create(
+                    model=self.model_name,
+                    display_name="retirechat-coach-prompt",
+                    system_instruction=RETIREMENT_COACH_PROMPT,
+                    tools=self.tools,
+                    ttl=datetime.timedelta(seconds=CONTEXT_CACHE_TTL_SECONDS)
+                )
+            except Exception as e:
+                # e.g. the prompt is below the model's minimum cacheable size
+                log_event("context_cache_unavailable", error=str(e))
+                self._context_cache_failed = True
+                return None
+            
+            self._cached_model = genai.GenerativeModel.from_cached_content(
+                cached_content,
+                safety_settings=self.safety_settings
+            )
+            # Refresh a minute early so in-flight requests never reference an expired cache
+            self._cached_model_expires = time.time() + max(CONTEXT_CACHE_TTL_SECONDS - 60, 0)
+            return self._cached_model
+    
+    def generation_config(self, attempt_number):
+        if self._generation_configs is None:
+            self._generation_configs = tuple(build_generation_config(i) for i in range(self.max_attempts))
+        return self._generation_configs[min(attempt_number, self.max_attempts - 1)]
+    
+    def warm_up(self, runner=None):
+        """Pay the cold-start costs (SDK import, client and connection setup, context cache) up front"""
+        started = time.perf_counter()
+        try:
+            self.generation_config(0)
+            model = self.model()
+            # count_tokens is free and opens the same channel generate_content will use
+            model.count_tokens("warm-up")
+            if runner is not None and hasattr(model, "count_tokens_async"):
+                runner.run(model.count_tokens_async("warm-up"))
+        except Exception as e:
+            log_event("warmup_error", error=str(e))
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(seconds, stage="warmup")
+        log_event("warmup", seconds=round(seconds, 4), backend=self.backend)
+    
+    def record_setup(self, seconds):
+        with self._lock:
+            self._setup_calls += 1
+            self._setup_seconds += seconds
+            self._setup_max_seconds = max(self._setup_max_seconds, seconds)
+    
+    def stats(self):
+        """Per-call setup overhead observed so far, in milliseconds"""
+        with self._lock:
+            calls = self._setup_calls
+            return {
+                "calls": calls,
+                "avg_setup_ms": (self._setup_seconds / calls * 1000) if calls else 0.0,
+                "max_setup_ms": self._setup_max_seconds * 1000,
+            }
+
+@process_singleton
+def get_client_pool():
+    """Single client pool per server process"""
+    pool = GeminiClientPool()
+    metrics.REGISTRY.gauge(
+        "retirechat_call_setup_avg_ms", "Average per-call setup overhead",
+        lambda: pool.stats()["avg_setup_ms"]
+    )
+    return pool
+
+@process_singleton
+def get_admission_controller():
+    """Single admission queue per server process, shared by every session"""
+    admission = AdmissionController(
+        max_in_flight=MAX_IN_FLIGHT_CALLS,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        tokens_per_minute=TOKENS_PER_MINUTE
+    )
+    metrics.REGISTRY.gauge("retirechat_calls_in_flight", "Gemini calls in flight", lambda: admission.stats()["in_flight"])
+    metrics.REGISTRY.gauge("retirechat_calls_queued", "Gemini calls waiting for admission", lambda: admission.stats()["queued"])
+    return admission
+
+def estimate_request_tokens(context, gen_config):
+    """Tokens a call may consume: prompt plus the most it can generate"""
+    if isinstance(context, str):
+        prompt_tokens = estimate_tokens(context)
+    else:
+        # Structured turns; the coach prompt is sent separately as system_instruction
+        prompt_tokens = estimate_tokens(RETIREMENT_COACH_PROMPT) + sum(
+            estimate_tokens(part) for content in context for part in content["parts"]
+        )
+    return prompt_tokens + gen_config.max_output_tokens
+
+@process_singleton
+def get_inflight_registry():
+    """Single in-flight request registry per server process"""
+    registry = InflightRegistry()
+    for name in ("upstream_calls", "coalesced", "superseded", "abandoned"):
+        metrics.REGISTRY.gauge(
+            f"retirechat_inflight_{name}", f"Single-flight {name.replace('_', ' ')} since start",
+            lambda name=name: registry.stats()[name]
+        )
+    return registry
+
+@process_singleton
+def get_response_cache():
+    """Single response cache per server process"""
+    cache = ResponseCache(
+        max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+        ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+        path=RESPONSE_CACHE_PATH
+    )
+    for name in ("hits", "misses", "entries"):
+        metrics.REGISTRY.gauge(
+            f"retirechat_response_cache_{name}", f"Response cache {name}",
+            lambda name=name: cache.stats()[name]
+        )
+    return cache
+
+@process_singleton
+def get_conversation_backend():
+    """Single transcript store per server process, or None when persistence is disabled"""
+    if not CONVERSATION_DB_PATH:
+        return None
+    backend = SQLiteConversationBackend(CONVERSATION_DB_PATH, retention_days=CONVERSATION_RETENTION_DAYS)
+    for name in ("pending_writes", "batches", "rows_written", "rows_purged", "write_errors"):
+        metrics.REGISTRY.gauge(
+            f"retirechat_conversation_{name}", f"Conversation store {name.replace('_', ' ')}",
+            lambda name=name: backend.stats()[name]
+        )
+    return backend
+
+def _session_signature(nonce):
+    return hmac.new(SESSION_SECRET.encode("utf-8"), nonce.encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+
+def new_session_id():
+    """A fresh session id signed with SESSION_SECRET"""
+    nonce = uuid.uuid4().hex
+    return f"{nonce}-{_session_signature(nonce)}"
+
+def issued_session_id(value):
+    """value if it is a session id this deployment issued, otherwise None"""
+    if not isinstance(value, str) or not SESSION_ID.fullmatch(value):
+        return None
+    nonce, signature = value.split("-")
+    if not hmac.compare_digest(signature, _session_signature(nonce)):
+        return None
+    return value
+
+def response_cache_key(user_input, conversation_history):
+    """Cache key for a turn, or None if the turn should not be cached"""
+    messages = [msg for msg in conversation_history if msg["role"] != "summary"]
+    if len(messages) > RESPONSE_CACHE_MAX_HISTORY:
+        return None
+    pool = get_client_pool()
+    return ResponseCache.make_key(
+        user_input,
+        [(msg["role"], msg["content"]) for msg in conversation_history],
+        pool.model_name,
+        PROMPT_MODE,
+        pool.generation_config(0),
+        # Everything else that shapes the answer, so a persistent cache never serves
+        # answers written under an older prompt, safety or tool configuration after a deploy
+        RETIREMENT_COACH_PROMPT,
+        pool.safety_settings,
+        pool.tools
+    )
+
+def prepare_model_call(user_input, conversation_history, attempt_number, pool=None):
+    """Resolve the shared model, prompt and config for one call, recording setup overhead"""
+    started = time.perf_counter()
+    pool = pool or get_client_pool()
+    model = pool.model()
+    context_started = time.perf_counter()
+    context = build_context(user_input, conversation_history, snippets=retrieve_knowledge(user_input))
+    STAGE_SECONDS.observe(time.perf_counter() - context_started, stage="context_build")
+    gen_config = pool.generation_config(attempt_number)
+    setup_seconds = time.perf_counter() - started
+    pool.record_setup(setup_seconds)
+    STAGE_SECONDS.observe(setup_seconds, stage="call_setup")
+    return model, context, gen_config
+
+async def get_ai_response_attempt(user_input, conversation_history, attempt_number, pool=None,
+                                  admission=None, on_queue=None, on_admitted=None, timeout=None, turn=None):
+    """Single attempt to get AI response with different configurations per attempt.
+    
+    on_admitted() is called once the attempt has been admitted and its model call starts.
+    """
+    admission = admission or get_admission_controller()
+    turn = turn or TurnMetrics()
+    ticket = None
+    started = None
+    outcome = "error"
+    try:
+        model, context, gen_config = prepare_model_call(user_input, conversation_history, attempt_number, pool)
+        
+        # Wait our turn; the timeout only covers the model call, not time spent queued
+        queued = time.perf_counter()
+        ticket = await admission.acquire_async(estimate_request_tokens(context, gen_config), on_wait=on_queue)
+        started = time.perf_counter()
+        STAGE_SECONDS.observe(started - queued, stage="admission_wait")
+        if on_admitted:
+            on_admitted()
+        response = await asyncio.wait_for(
+            model.generate_content_async(
+                context,
+                generation_config=gen_config
+            ),
+            timeout=timeout
+        )
+        turn.record_response(response)
+        
+        # Answer tool calls locally and let the model explain the results
+        for _ in range(MAX_TOOL_ROUNDS):
+            calls = function_calls(response)
+            if not calls:
+                break
+            context = with_tool_results(context, calls)
+            response = await asyncio.wait_for(
+                model.generate_content_async(
+                    context,
+                    generation_config=gen_config
+                ),
+                timeout=timeout
+            )
+            turn.record_response(response)
+        
+        # Enhanced response extraction with multiple fallback methods
+        text = extract_response_safely(response, user_input)
+        outcome = "success" if text else "empty"
+        return text
+        
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise
+    except TRANSIENT_ERRORS:
+        # Let the scheduler back off and retry
+        outcome = "transient_error"
+        raise
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except Exception as e:
+        # Log the specific error but don't expose to user
+        log_event("attempt_error", attempt=attempt_number, error=str(e))
+        return None
+    finally:
+        if ticket is not None:
+            admission.release(ticket)
+        if started is not None:
+            turn.attempt(attempt_number, time.perf_counter() - started, outcome)
+
+def extract_chunk_text(chunk):
+    """Get the text of a streamed chunk, or an empty string if it carries none"""
+    try:
+        return chunk.text or ""
+    except:
+        pass
+    
+    # Chunks without a valid text part raise on .text (e.g. a final SAFETY chunk)
+    try:
+        return "".join(part.text for part in chunk.candidates[0].content.parts)
+    except:
+        return ""
+
+def function_calls(response):
+    """Function calls the model requested in a response or streamed chunk"""
+    try:
+        parts = response.candidates[0].content.parts
+    except (AttributeError, IndexError, TypeError):
+        return []
+    calls = []
+    for part in parts:
+        call = getattr(part, "function_call", None)
+        if call is not None and call.name:
+            calls.append(call)
+    return calls
+
+def run_tool(call):
+    """Execute one function call locally and wrap the result as a function_response part"""
+    protos = load_genai().protos
+    started = time.perf_counter()
+    function = TOOL_FUNCTIONS.get(call.name)
+    try:
+        if function is None:
+            raise ValueError(f"unknown function {call.name}")
+        result = function(**{key: value for key, value in call.args.items()})
+    except (TypeError, ValueError) as e:
+        # Bad arguments go back to the model so it can ask the user or correct itself
+        result = {"error": str(e)}
+    seconds = time.perf_counter() - started
+    STAGE_SECONDS.observe(seconds, stage="tool")
+    log_event("tool_call", name=call.name, seconds=round(seconds, 4), error=result.get("error"))
+    return protos.Part(function_response=protos.FunctionResponse(name=call.name, response=result))
+
+def with_tool_results(context, calls):
+    """Model input for the follow-up call: the original turns, the model's calls and their results"""
+    protos = load_genai().protos
+    contents = [{"role": "user", "parts": [context]}] if isinstance(context, str) else list(context)
+    contents.append({"role": "model", "parts": [protos.Part(function_call=call) for call in calls]})
+    contents.append({"role": "user", "parts": [run_tool(call) for call in calls]})
+    return contents
+
+def stream_ai_response_attempt(user_input, conversation_history, attempt_number=0, on_queue=None, cancel_event=None,
+                               turn=None, deadline=None):
+    """Single streaming attempt; yields text chunks and returns the resolved response.
+    
+    deadline is the time.perf_counter() value the turn must finish by; a stream that
+    stalls or runs past it raises StreamTimeout.
+    """
+    turn = turn or TurnMetrics()
+    model, context, gen_config = prepare_model_call(user_input, conversation_history, attempt_number)
+    
+    admission = get_admission_controller()
+    queued = time.perf_counter()
+    if deadline is None:
+        deadline = queued + TURN_DEADLINE_SECONDS
+    ticket = admission.acquire(
+        estimate_request_tokens(context, gen_config),
+        on_wait=on_queue,
+        timeout=max(0.0, deadline - queued),
+        cancel_event=cancel_event
+    )
+    started = time.perf_counter()
+    STAGE_SECONDS.observe(started - queued, stage="admission_wait")
+    outcome = "error"
+    try:
+        for tool_round in range(MAX_TOOL_ROUNDS + 1):
+            stream = TimedStream(
+                lambda context=context: model.generate_content(
+                    context,
+                    generation_config=gen_config,
+                    stream=True,
+                    # Also ends the helper thread of a stream we stopped waiting for
+                    request_options={"timeout": max(1.0, deadline - time.perf_counter())}
+                ),
+                deadline
+            )
+            
+            if tool_round == 0:
+                outcome = "empty"
+            calls = []
+            for chunk in stream:
+                if cancel_event is not None and cancel_event.is_set():
+                    outcome = "cancelled"
+                    break
+                calls.extend(function_calls(chunk))
+                text = extract_chunk_text(chunk)
+                if text:
+                    outcome = "success"
+                    yield text
+            
+            response = stream.response
+            if outcome == "cancelled":
+                break
+            turn.record_response(response)
+            if not calls or tool_round == MAX_TOOL_ROUNDS:
+                break
+            # Answer the tool calls locally, then stream the model's explanation of the results
+            context = with_tool_results(context, calls)
+    except StreamTimeout:
+        outcome = "timeout"
+        raise
+    finally:
+        # Hold the slot until the stream is fully consumed
+        admission.release(ticket)
+        turn.attempt(attempt_number, time.perf_counter() - started, outcome, mode="stream")
+    
+    return response
+
+def get_ai_response_stream(user_input, conversation_history, conversation_context=None, on_queue=None,
+                           cancel_event=None):
+    """Stream the AI response, falling back to the retry path if the stream produces nothing"""
+    turn = TurnMetrics()
+    source = "cancelled"
+    try:
+        started = time.perf_counter()
+        deadline = started + TURN_DEADLINE_SECONDS
+        conversation_history = (conversation_context or ConversationContext()).window(conversation_history)
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="history_window")
+        
+        cache_key = response_cache_key(user_input, conversation_history)
+        if cache_key:
+            cached = get_response_cache().get(cache_key)
+            if cached:
+                source = "cache"
+                turn.first_token()
+                yield cached
+                return
+        
+        streamed = []
+        response = None
+        
+        try:
+            stream = stream_ai_response_attempt(
+                user_input,
+                conversation_history,
+                on_queue=on_queue,
+                cancel_event=cancel_event,
+                turn=turn,
+                deadline=deadline
+            )
+            while True:
+                try:
+                    text = next(stream)
+                except StopIteration as stop:
+                    response = stop.value
+                    break
+                turn.first_token()
+                streamed.append(text)
+                yield text
+        except AdmissionTimeout as e:
+            # Still queued at the turn deadline; don't pile more calls onto an overloaded quota
+            log_event("stream_not_admitted", error=str(e))
+            source = "fallback"
+            yield generate_fallback_response(user_input)
+            return
+        except AdmissionCancelled:
+            return
+        except Exception as e:
+            log_event("stream_error", error=str(e), streamed_chunks=len(streamed))
+            if streamed:
+                # Part of the answer is already on screen, so close it off gracefully
+                source = "partial"
+                yield "\n\n*My response was cut short. Feel free to ask me to continue.*"
+                return
+        
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        
+        if streamed:
+            source = "model"
+            if cache_key:
+                get_response_cache().put(cache_key, "".join(streamed))
+            return
+        
+        # Nothing was streamed: the stream was blocked or terminated before any text
+        text = None
+        if response is not None:
+            try:
+                text = extract_response_safely(response, user_input)
+            except Exception as e:
+                log_event("stream_extraction_error", error=str(e))
+        
+        if not text or text.startswith("I apologize"):
+            # Also reached when the stream stalled; the retries get what is left of the turn
+            text = get_ai_response_with_retry(
+                user_input,
+                conversation_history,
+                first_attempt=1,
+                on_queue=on_queue,
+                cancel_event=cancel_event,
+                turn=turn,
+                time_budget=deadline - time.perf_counter()
+            )
+            if cancel_event is not None and cancel_event.is_set():
+                return
+        
+        source = response_source(text, user_input)
+        if cache_key and source == "model":
+            get_response_cache().put(cache_key, text)
+        turn.first_token()
+        yield text
+    finally:
+        turn.finish(source, prompt_mode=PROMPT_MODE)
+
+def extract_response_safely(response, original_input):
+    """Safely extract response from Gemini API with multiple fallback methods"""
+    
+    # Method 1: Direct text access
+    try:
+        if hasattr(response, 'text') and response.text:
+            return response.text
+    except:
+        pass
+    
+    # Method 2: Check candidates and finish reasons
+    if hasattr(response, 'candidates') and response.candidates:
+        candidate = response.candidates[0]
+        
+        # Handle different finish reasons
+        finish_reason = getattr(candidate, 'finish_reason', None)
+        
+        if finish_reason == 1:  # STOP - successful completion
+            try:
+                if hasattr(candidate, 'content') and candidate.content:
+                    if hasattr(candidate.content, 'parts') and candidate.content.parts:
+                        return candidate.content.parts[0].text
+            except:
+                pass
+        
+        elif finish_reason == 2:  # SAFETY
+            return generate_safety_bypass_response(original_input)
+        
+        elif finish_reason == 3:  # RECITATION
+            return generate_recitation_bypass_response(original_input)
+        
+        elif finish_reason == 4:  # OTHER
+            return generate_other_error_response(original_input)
+    
+    # Method 3: Try to access parts directly
+    try:
+        if response.candidates[0].content.parts:
+            return response.candidates[0].content.parts[0].text
+    except:
+        pass
+    
+    # Method 4: Check prompt feedback
+    if hasattr(response, 'prompt_feedback'):
+        feedback = response.prompt_feedback
+        if hasattr(feedback, 'block_reason'):
+            return generate_prompt_feedback_response(original_input, feedback.block_reason)
+    
+    return None
+
+def generate_safety_bypass_response(original_input):
+    """Generate a helpful response when safety filters are triggered"""
+    financial_keywords = ['retirement', 'savings', 'investment', 'financial', 'money', 'plan', 'budget', 'debt', 'income']
+    
+    if any(keyword in original_input.lower() for keyword in financial_keywords):
+        return f"""I understand you're asking about retirement planning. Let me help you with that.
+
+For personalized retirement planning advice, I can assist with:
+
+• Retirement savings strategies and goal setting
+• Investment allocation recommendations for your age group
+• Steps to improve your financial situation for retirement
+• Educational resources for financial planning
+• Creating actionable retirement timelines
+
+Could you tell me more specifically about your retirement planning goals? For example:
+- What's your current age and career stage?
+- Are you looking to create a new retirement plan or improve an existing one?
+- What's your main concern about retirement planning right now?
+
+This will help me provide more targeted guidance for your situation."""
+    
+    return f"""I'm here to help with retirement planning and financial guidance. Let me address your question about financial planning.
+
+Based on your inquiry, I can provide guidance on:
+
+• Developing a comprehensive retirement strategy
+• Understanding different retirement account options
+• Creating realistic savings goals and timelines
+• Professional development for career advancement
+• Resources for financial education and planning
+
+What specific aspect of retirement planning would you like to focus on today?"""
+
+def generate_recitation_bypass_response(original_input):
+    """Generate response when recitation filters are triggered"""
+    return """I'd be happy to provide original, personalized retirement planning advice tailored to your specific situation.
+
+Let me offer some general guidance that might help:
+
+**Getting Started with Retirement Planning:**
+1. Assess your current financial position
+2. Define your retirement timeline and goals
+3. Explore available retirement account options
+4. Consider your risk tolerance for investments
+5. Create a systematic savings approach
+
+**Next Steps:**
+To give you more specific advice, could you share:
+- Your approximate age or career stage?
+- Whether you have existing retirement savings?
+- Any specific retirement planning challenges you're facing?
+
+This will help me provide more targeted, personalized guidance for your unique situation."""
+
+def generate_other_error_response(original_input):
+    """Generate response for other types of API errors"""
+    return """I'm ready to help you with comprehensive retirement planning guidance.
+
+**Common Retirement Planning Areas I Can Assist With:**
+• Creating a personalized retirement savings strategy
+• Understanding 401(k), IRA, and other retirement accounts
+• Calculating retirement income needs
+• Investment allocation strategies by age
+• Career development for increased earning potential
+• Debt management strategies before retirement
+
+**Let's Get Started:**
+What's the most important retirement planning question on your mind right now? I can provide specific, actionable advice once I understand your particular situation and goals."""
+
+def generate_prompt_feedback_response(original_input, block_reason):
+    """Generate response when prompt is blocked for various reasons"""
+    return f"""I understand you're seeking retirement planning guidance. Let me help you with professional financial planning advice.
+
+**Professional Retirement Planning Services:**
+I can provide expert guidance on retirement strategies, savings optimization, and financial goal setting.
+
+**How I Can Help:**
+• Personalized retirement planning recommendations
+• Investment strategy guidance
+• Career development planning
+• Financial goal prioritization
+• Action plan development
+
+**Your Next Step:**
+Please share what specific retirement planning topic you'd like to explore, and I'll provide detailed, professional guidance tailored to your needs."""
+
+def generate_fallback_response(original_input):
+    """Generate a comprehensive fallback response when all AI attempts fail"""
+    return """**Professional Retirement Planning Assistance**
+
+I'm here to provide comprehensive retirement planning guidance. Even though I'm experiencing a temporary technical issue, I can still help structure your thinking around retirement planning.
+
+**Key Areas We Can Explore:**
+
+**Assessment Phase:**
+• Current financial position evaluation
+• Retirement timeline planning
+• Goal setting and prioritization
+
+**Strategy Development:**
+• Savings rate optimization
+• Investment allocation by age
+• Risk tolerance assessment
+• Tax-advantaged account utilization
+
+**Implementation:**
+• Step-by-step action plans
+• Milestone tracking
+• Regular plan review and adjustment
+
+**Professional Development:**
+• Career advancement strategies
+• Skills development for earning potential
+• Industry-specific retirement considerations
+
+**What Would Be Most Helpful?**
+Please let me know what specific aspect of retirement planning you'd like to focus on, and I'll provide detailed guidance and actionable next steps.
+
+You can ask about:
+- Creating a retirement savings strategy
+- Understanding investment options
+- Career development planning
+- Specific financial planning calculations
+- Timeline and milestone development"""
+
+@functools.lru_cache(maxsize=1)
+def canned_responses():
+    """All fixed texts the fallback generators can return"""
+    return frozenset([
+        generate_safety_bypass_response("retirement"),
+        generate_safety_bypass_response(""),
+        generate_recitation_bypass_response(""),
+        generate_other_error_response(""),
+        generate_prompt_feedback_response("", None),
+        generate_fallback_response(""),
+    ])
+
+def is_canned_response(text):
+    """True if the text came from a fallback generator rather than the model"""
+    return text in canned_responses()
+
+def response_source(text, user_input):
+    """Classify a final answer for metrics: the model, a canned bypass text, or the fallback"""
+    if text == generate_fallback_response(user_input):
+        return "fallback"
+    if is_canned_response(text):
+        return "canned"
+    return "model"
+
+def get_ai_response(user_input, conversation_history, conversation_context=None, on_queue=None, turn=None):
+    """Main function to get AI response with comprehensive error handling.
+    
+    Pass a TurnMetrics as turn to read the turn's source, latency and token usage afterwards.
+    """
+    turn = turn or TurnMetrics()
+    source = "error"
+    try:
+        started = time.perf_counter()
+        conversation_history = (conversation_context or ConversationContext()).window(conversation_history)
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="history_window")
+        
+        cache_key = response_cache_key(user_input, conversation_history)
+        if cache_key:
+            cached = get_response_cache().get(cache_key)
+            if cached:
+                source = "cache"
+                return cached
+        
+        response = get_ai_response_with_retry(user_input, conversation_history, on_queue=on_queue, turn=turn)
+        source = response_source(response, user_input)
+        if cache_key and source == "model":
+            get_response_cache().put(cache_key, response)
+        return response
+    finally:
+        turn.finish(source, prompt_mode=PROMPT_MODE)
+
+def start_flight(session_id, user_input, conversation_history, conversation_context=None):
+    """Join or start the session's single-flight call for this prompt and history.
+    
+    The upstream call runs on its own thread, so a rerun with the same prompt and
+    history picks up the same call (replaying what already streamed), while a
+    different prompt from the same session cancels it.
+    """
+    if isinstance(conversation_history, ConversationStore):
+        history = conversation_history.snapshot()
+    else:
+        history = list(conversation_history)
+    key = ResponseCache.make_key(user_input, [(msg["role"], msg["content"]) for msg in history], len(history))
+    
+    def producer(flight):
+        return get_ai_response_stream(
+            user_input,
+            history,
+            conversation_context,
+            on_queue=flight.set_queue_status,
+            cancel_event=flight.cancelled
+        )
+    
+    return get_inflight_registry().start(session_id, key, producer)
+
+def generate_plan_markdown(job, history, pool, admission):
+    """Stream the Plan of Action from the model, reporting progress on the job as text arrives.
+    
+    Raises StreamTimeout when the stream stalls or runs past PLAN_DEADLINE_SECONDS, so
+    a hung call can't hold an export worker.
+    """
+    model = pool.model()
+    context = build_context(PLAN_REQUEST, history)
+    gen_config = load_genai().types.GenerationConfig(
+        max_output_tokens=PLAN_MAX_OUTPUT_TOKENS,
+        temperature=0.4
+    )
+    
+    job.update(0.05, "Waiting for the coach")
+    ticket = admission.acquire(estimate_request_tokens(context, gen_config), timeout=TURN_DEADLINE_SECONDS)
+    deadline = time.perf_counter() + PLAN_DEADLINE_SECONDS
+    expected_chars = PLAN_MAX_OUTPUT_TOKENS * 3
+    parts = []
+    written = 0
+    try:
+        for _ in range(MAX_TOOL_ROUNDS + 1):
+            stream = TimedStream(
+                lambda context=context: model.generate_content(
+                    context,
+                    generation_config=gen_config,
+                    stream=True,
+                    request_options={"timeout": max(1.0, deadline - time.perf_counter())}
+                ),
+                deadline
+            )
+            calls = []
+            for chunk in stream:
+                calls.extend(function_calls(chunk))
+                text = extract_chunk_text(chunk)
+                if text:
+                    parts.append(text)
+                    written += len(text)
+                    job.update(0.1 + 0.7 * min(1.0, written / expected_chars), "Writing your plan")
+            if not calls:
+                break
+            context = with_tool_results(context, calls)
+    finally:
+        admission.release(ticket)
+    return "".join(parts)
+
+def assemble_plan_locally(history, summary):
+    """Fallback plan put together from the conversation itself when the model can't write one"""
+    lines = []
+    facts = [line for line in summary.splitlines()[1:] if line.strip()]
+    if facts:
+        lines.extend(["## Summary of Your Situation", ""] + facts + [""])
+    advice = [msg["content"] for msg in history if msg["role"] == "assistant"][-3:]
+    if advice:
+        lines.extend(["## Your Coach's Recommendations", ""])
+        for text in advice:
+            lines.extend([text, ""])
+    lines.extend([
+        "## Next Steps",
+        "",
+        "- Review this plan and your retirement contributions once a year",
+        "- Come back to RetireChat to update the plan as your situation changes",
+    ])
+    return "\n".join(lines)
+
+def build_plan_document(job, history, summary, pool, admission):
+    """Export job body: write the plan, then render every download format"""
+    try:
+        markdown = generate_plan_markdown(job, history, pool, admission)
+    except StreamTimeout as e:
+        log_event("plan_generation_timeout", error=str(e))
+        markdown = ""
+    except Exception as e:
+        log_event("plan_generation_error", error=str(e))
+        markdown = ""
+    if not markdown.strip():
+        job.update(0.8, "Assembling your plan from our conversation")
+        markdown = assemble_plan_locally(history, summary)
+    
+    job.update(0.85, "Formatting documents")
+    title = f"Plan of Action - {datetime.date.today():%B %d, %Y}"
+    return plan_export.render_plan(markdown, title)
+
+@process_singleton
+def get_export_manager():
+    """Single export worker pool per server process"""
+    manager = plan_export.ExportManager(max_workers=EXPORT_WORKERS)
+    for name in ("cached", "active", "cache_hits"):
+        metrics.REGISTRY.gauge(
+            f"retirechat_plan_exports_{name}", f"Plan of Action exports {name.replace('_', ' ')}",
+            lambda name=name: manager.stats()[name]
+        )
+    return manager
+
+def start_plan_export(session_id, conversation, evicted_context):
+    """Queue an export of the conversation (or reuse the one already made for it); None if it is empty.
+    
+    evicted_context summarizes only the messages the store no longer holds, so the
+    export's own, larger history budget decides how much of the rest is sent verbatim.
+    """
+    if not len(conversation):
+        return None
+    # Work on a snapshot and a fresh context so the chat can carry on while the export runs
+    snapshot = conversation.snapshot()
+    context = ConversationContext(PLAN_HISTORY_TOKEN_BUDGET)
+    context.summarized_count = snapshot.first_index
+    context.facts = dict(evicted_context.facts)
+    context.goals = list(evicted_context.goals)
+    context.topics = list(evicted_context.topics)
+    history = context.window(snapshot)
+    summary = context.summary_text()
+    pool = get_client_pool()
+    admission = get_admission_controller()
+    return get_export_manager().submit(
+        session_id,
+        conversation.version,
+        lambda job: build_plan_document(job, history, summary, pool, admission)
+    )
+
+@process_singleton
+def start_warmup():
+    """Warm the client pool on a background thread once per server process"""
+    if not WARMUP_ON_START:
+        return None
+    thread = threading.Thread(
+        target=get_client_pool().warm_up, args=(get_async_runner(),), name="warmup", daemon=True
+    )
+    thread.start()
+    return thread
+
+@process_singleton
+def start_metrics_server():
+    """Start the metrics endpoint once per server process"""
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+
+class ChatSession:
+    """One conversation as every client sees it: transcript, rolling context and the turn loop.
+    
+    The transcript resumes from the conversation store when persistence is enabled,
+    and a turn is only recorded once its answer has streamed in full; a turn that
+    is superseded by a newer prompt from the same session leaves no trace.
+    """
+    
+    def __init__(self, session_id=None):
+        if session_id is not None and issued_session_id(session_id) is None:
+            # The id names the spill file and the stored transcript, so only our own are accepted
+            raise ValueError("not a session id issued by this deployment")
+        self.session_id = session_id or new_session_id()
+        self.context = ConversationContext()
+        # Summary of the messages evicted from the store alone, for exports with their own budget
+        self.evicted_context = ConversationContext()
+        backend = get_conversation_backend()
+        if backend is not None:
+            self.conversation = ConversationStore.resume(
+                session_id=self.session_id,
+                backend=backend,
+                max_messages=MAX_SESSION_MESSAGES,
+                spill_dir=SPILL_DIR,
+                on_evict=self._fold_evicted
+            )
+        else:
+            self.conversation = ConversationStore(
+                session_id=self.session_id,
+                max_messages=MAX_SESSION_MESSAGES,
+                spill_dir=SPILL_DIR,
+                on_evict=self._fold_evicted
+            )
+        self._lock = threading.Lock()
+    
+    def _fold_evicted(self, index, message):
+        self.context.fold_evicted(index, message)
+        self.evicted_context.fold_evicted(index, message)
+    
+    def reply(self, user_input, on_queue=None):
+        """Stream the coach's answer as text chunks, then record the turn"""
+        flight = start_flight(self.session_id, user_input, self.conversation, self.context)
+        chunks = []
+        for text in flight.iter_chunks(on_queue=on_queue):
+            chunks.append(text)
+            yield text
+        
+        if flight.cancelled.is_set():
+            return
+        _, content = self.record(flight, user_input, chunks)
+        if not chunks:
+            yield content
+    
+    async def reply_events(self, user_input):
+        """Async counterpart of reply() for the API: yields (event, data) pairs.
+        
+        Events are ("queue", {"position", "expected_seconds"}), ("text", str) and
+        finally ("done", {"index", "content"}) or ("cancelled", {}). The consumer waits
+        on the event loop; the flight's producer still runs the turn on its own thread.
+        """
+        flight = start_flight(self.session_id, user_input, self.conversation, self.context)
+        chunks = []
+        async for kind, data in flight.aiter_events():
+            if kind == "queue":
+                yield "queue", {"position": data[0], "expected_seconds": round(data[1], 1)}
+            else:
+                chunks.append(data)
+                yield "text", data
+        
+        if flight.cancelled.is_set():
+            yield "cancelled", {}
+            return
+        index, content = self.record(flight, user_input, chunks)
+        if not chunks:
+            yield "text", content
+        yield "done", {"index": index, "content": content}
+    
+    def record(self, flight, user_input, chunks):
+        """Append a finished flight's turn once, however many consumers followed it.
+        
+        Returns (index of the assistant message, its content); consumers that joined
+        the flight get what the first one recorded.
+        """
+        with self._lock:
+            if flight.recorded is None:
+                content = "".join(chunks) or generate_fallback_response(user_input)
+                self.conversation.append("user", user_input)
+                self.conversation.append("assistant", content)
+                flight.recorded = (len(self.conversation) - 1, content)
+            return flight.recorded
+    
+    def clear(self):
+        with self._lock:
+            self.conversation.clear()
+            self.context.reset()
+            self.evicted_context.reset()
+        get_inflight_registry().cancel_session(self.session_id)
+    
+    def export_plan(self):
+        """Start (or reuse) the Plan of Action export; None while the conversation is empty"""
+        return start_plan_export(self.session_id, self.conversation, self.evicted_context)
+    
+    def latest_export(self):
+        return get_export_manager().latest(self.session_id)
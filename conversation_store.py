@@ -0,0 +1,371 @@
+import atexit
+import collections
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+
+import metrics
+
+# Messages folded per backend read when resuming a long conversation
+RESUME_PAGE_SIZE = 200
+
+
+class Message:
+    """Compact chat message; supports msg["role"] / msg["content"] like the old dicts"""
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        self.role = sys.intern(role)
+        self.content = content
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def to_dict(self):
+        return {"role": self.role, "content": self.content}
+
+    def size_bytes(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.content)
+
+
+class ConversationStore:
+    """The one transcript a session keeps, used for both rendering and context building.
+
+    Indexing is absolute: len() counts every message ever appended and store[i]
+    addresses the i-th of them, so positions stay stable after old messages are
+    evicted by the retention cap. Evicted messages are passed to on_evict and,
+    when spill_dir is set, appended to a JSON-lines file for the session.
+    """
+
+    def __init__(self, session_id=None, max_messages=200, spill_dir=None, on_evict=None, backend=None):
+        self.session_id = session_id
+        self.max_messages = max_messages
+        self.spill_dir = spill_dir
+        self.on_evict = on_evict
+        self.backend = backend
+        self.first_index = 0
+        self.version = 0  # bumped on every change, e.g. to key derived artifacts
+        self._messages = []
+        self._bytes = 0
+        _LIVE_STORES.add(self)
+
+    @classmethod
+    def resume(cls, session_id, backend, max_messages=200, spill_dir=None, on_evict=None):
+        """Rebuild a session from the backend, holding only the newest max_messages in memory.
+
+        Older messages are streamed through on_evict page by page (so they still reach
+        the conversation summary) and are not kept.
+        """
+        store = cls(session_id, max_messages, spill_dir, on_evict, backend)
+        total = backend.count(session_id)
+        start = max(0, total - max_messages) if max_messages else 0
+        if on_evict:
+            for page_start in range(0, start, RESUME_PAGE_SIZE):
+                for index, message in store._load(page_start, min(start, page_start + RESUME_PAGE_SIZE)):
+                    on_evict(index, message)
+        store.first_index = start
+        for _, message in store._load(start, total):
+            store._messages.append(message)
+            store._bytes += message.size_bytes()
+        store.version = total
+        return store
+
+    def append(self, role, content):
+        message = Message(role, content)
+        if self.backend is not None:
+            self.backend.append(self.session_id, message.role, message.content)
+        self._messages.append(message)
+        self._bytes += message.size_bytes()
+        self.version += 1
+        if self.max_messages and len(self._messages) > self.max_messages:
+            self._evict(len(self._messages) - self.max_messages)
+        return message
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear(self.session_id)
+        self.version += 1
+        self.first_index = 0
+        self._messages = []
+        self._bytes = 0
+
+    def page(self, start, stop):
+        """Messages start..stop-1 for display, reading evicted ones back from the backend"""
+        start = max(0, start)
+        stop = min(stop, len(self))
+        older = []
+        if start < self.first_index:
+            older = [message for _, message in self._load(start, min(stop, self.first_index))]
+        return older + self[max(start, self.first_index):stop]
+
+    def snapshot(self):
+        """Detached copy sharing the same message objects, for use on another thread"""
+        copy = ConversationStore.__new__(ConversationStore)
+        copy.session_id = self.session_id
+        copy.max_messages = 0
+        copy.spill_dir = None
+        copy.on_evict = None
+        copy.backend = None
+        copy.first_index = self.first_index
+        copy.version = self.version
+        copy._messages = list(self._messages)
+        copy._bytes = self._bytes
+        return copy
+
+    def memory_bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return self.first_index + len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            start = max(start, self.first_index) - self.first_index
+            stop = max(stop, self.first_index) - self.first_index
+            return self._messages[start:stop:step]
+        if index < 0:
+            index += len(self)
+        if index < self.first_index:
+            raise IndexError(f"message {index} was evicted from memory")
+        return self._messages[index - self.first_index]
+
+    def _load(self, start, stop):
+        if self.backend is None or start >= stop:
+            return []
+        return [(index, Message(role, content)) for index, role, content in self.backend.load(self.session_id, start, stop)]
+
+    def _evict(self, count):
+        evicted, self._messages = self._messages[:count], self._messages[count:]
+        for offset, message in enumerate(evicted):
+            self._bytes -= message.size_bytes()
+            if self.on_evict:
+                self.on_evict(self.first_index + offset, message)
+        if self.spill_dir and self.session_id:
+            self._spill(evicted)
+        self.first_index += count
+
+    def _spill(self, messages):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"{self.session_id}.jsonl")
+        with _SPILL_LOCK, open(path, "a", encoding="utf-8") as spill:
+            for message in messages:
+                spill.write(json.dumps(message.to_dict()) + "\n")
+
+
+class ConversationBackend:
+    """Durable home for transcripts, shared by every server instance that can see it.
+
+    append and clear may be asynchronous, but must be applied in call order;
+    count and load must reflect every earlier append and clear from this process
+    for that session. The backend assigns positions itself, so two instances
+    appending to one session interleave their messages instead of overwriting them.
+    """
+
+    def append(self, session_id, role, content):
+        raise NotImplementedError
+
+    def clear(self, session_id):
+        raise NotImplementedError
+
+    def count(self, session_id):
+        raise NotImplementedError
+
+    def load(self, session_id, start, stop):
+        """(index, role, content) rows for start <= index < stop, oldest first"""
+        raise NotImplementedError
+
+    def flush(self, session_id=None):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class SQLiteConversationBackend(ConversationBackend):
+    """SQLite in WAL mode; writes are queued and committed in batches by a background thread.
+
+    With retention_days set, the writer also deletes sessions that have been idle
+    for longer than that, checking at most every purge_interval seconds.
+    """
+
+    def __init__(self, path, batch_size=100, flush_interval=0.05, retention_days=0, purge_interval=3600):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.purge_interval = purge_interval
+        self.batches = 0
+        self.rows_written = 0
+        self.rows_purged = 0
+        self.write_errors = 0
+        self._queue = queue.Queue()
+        self._pending = collections.Counter()  # session_id -> queued writes not yet committed
+        self._pending_changed = threading.Condition()
+        self._next_purge = 0
+        self._writer = self._connect()
+        self._writer.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "session_id TEXT NOT NULL, position INTEGER NOT NULL, role TEXT NOT NULL, "
+            "content TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (session_id, position)"
+            ") WITHOUT ROWID"
+        )
+        # Transactions are opened explicitly (BEGIN IMMEDIATE) so position allocation can't race
+        self._writer.isolation_level = None
+        self._reader = self._connect()
+        self._reader_lock = threading.Lock()
+        threading.Thread(target=self._run, name="conversation-writer", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def append(self, session_id, role, content):
+        self._enqueue("append", (session_id, role, content, time.time(), session_id))
+
+    def clear(self, session_id):
+        self._enqueue("clear", (session_id,))
+
+    def _enqueue(self, op, args):
+        with self._pending_changed:
+            self._pending[args[0]] += 1
+        self._queue.put((op, args))
+
+    def count(self, session_id):
+        self.flush(session_id)
+        with self._reader_lock:
+            row = self._reader.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0]
+
+    def load(self, session_id, start, stop):
+        self.flush(session_id)
+        with self._reader_lock:
+            return self._reader.execute(
+                "SELECT position, role, content FROM messages "
+                "WHERE session_id = ? AND position >= ? AND position < ? ORDER BY position",
+                (session_id, start, stop)
+            ).fetchall()
+
+    def flush(self, session_id=None):
+        """Block until the session's queued writes (every session's when None) have been committed"""
+        with self._pending_changed:
+            if session_id is None:
+                self._pending_changed.wait_for(lambda: not self._pending)
+            else:
+                self._pending_changed.wait_for(lambda: session_id not in self._pending)
+
+    def stats(self):
+        return {
+            "pending_writes": self._queue.qsize(),
+            "batches": self.batches,
+            "rows_written": self.rows_written,
+            "rows_purged": self.rows_purged,
+            "write_errors": self.write_errors,
+        }
+
+    def _run(self):
+        while True:
+            if self.retention_days and time.monotonic() >= self._next_purge:
+                self._next_purge = time.monotonic() + self.purge_interval
+                try:
+                    self._purge()
+                except sqlite3.Error as e:
+                    metrics.log_event("conversation_purge_error", error=str(e))
+            try:
+                batch = [self._queue.get(timeout=self.purge_interval if self.retention_days else None)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except sqlite3.Error as e:
+                self.write_errors += 1
+                metrics.log_event("conversation_write_error", error=str(e), dropped=len(batch))
+            finally:
+                with self._pending_changed:
+                    for _, args in batch:
+                        self._pending[args[0]] -= 1
+                        if not self._pending[args[0]]:
+                            del self._pending[args[0]]
+                    self._pending_changed.notify_all()
+
+    def _write(self, batch):
+        # One transaction per batch; appends and clears keep their queue order. IMMEDIATE takes
+        # the write lock up front, so the next position is read and used under the same lock
+        self._writer.execute("BEGIN IMMEDIATE")
+        try:
+            for op, args in batch:
+                if op == "append":
+                    self._writer.execute(
+                        "INSERT INTO messages (session_id, position, role, content, created) "
+                        "SELECT ?, COALESCE(MAX(position) + 1, 0), ?, ?, ? FROM messages WHERE session_id = ?", args
+                    )
+                else:
+                    self._writer.execute("DELETE FROM messages WHERE session_id = ?", args)
+            self._writer.execute("COMMIT")
+        except sqlite3.Error:
+            self._writer.execute("ROLLBACK")
+            raise
+        self.batches += 1
+        self.rows_written += sum(1 for op, _ in batch if op == "append")
+
+    def _purge(self):
+        """Delete every session whose newest message is older than the retention period"""
+        cutoff = time.time() - self.retention_days * 86400
+        self._writer.execute("BEGIN IMMEDIATE")
+        try:
+            purged = self._writer.execute(
+                "DELETE FROM messages WHERE session_id IN "
+                "(SELECT session_id FROM messages GROUP BY session_id HAVING MAX(created) < ?)", (cutoff,)
+            ).rowcount
+            self._writer.execute("COMMIT")
+        except sqlite3.Error:
+            self._writer.execute("ROLLBACK")
+            raise
+        self.rows_purged += purged
+        if purged:
+            metrics.log_event("conversation_purge", rows=purged, retention_days=self.retention_days)
+
+
+_LIVE_STORES = weakref.WeakSet()
+_SPILL_LOCK = threading.Lock()
+
+
+def _live_sizes():
+    return [store.memory_bytes() for store in list(_LIVE_STORES)]
+
+
+metrics.REGISTRY.gauge("retirechat_sessions", "Conversation stores held in memory", lambda: len(_live_sizes()))
+metrics.REGISTRY.gauge(
+    "retirechat_session_memory_bytes_total", "Transcript bytes held across all sessions",
+    lambda: sum(_live_sizes())
+)
+metrics.REGISTRY.gauge(
+    "retirechat_session_memory_bytes_max", "Largest single-session transcript in bytes",
+    lambda: max(_live_sizes(), default=0)
+)
@@ -56,6 +56,7 @@ gcloud run deploy $SERVICE_NAME \
     --memory 1Gi \
     --cpu 1 \
     --max-instances 10 \
+    --cpu-boost \
     --set-env-vars GOOGLE_API_KEY=$GOOGLE_API_KEY
 
 # Get the service URL
@@ -0,0 +1,193 @@
+import asyncio
+import threading
+import time
+
+from metrics import log_event
+
+
+class Flight:
+    """One upstream request whose streamed output can be read by any number of consumers"""
+
+    def __init__(self, session_id, key):
+        self.session_id = session_id
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.finished_at = None  # time.monotonic() when the flight finished
+        self.delivered = False
+        self.recorded = None  # set by whichever consumer stores the finished output, so it happens once
+        self.cancelled = threading.Event()
+        self.queue_status = None  # (position, expected_seconds) while waiting for admission
+        self._condition = threading.Condition()
+        self._async_waiters = set()  # (loop, asyncio.Event) of aiter_events consumers
+
+    def publish(self, text):
+        with self._condition:
+            self.chunks.append(text)
+            self._notify()
+
+    def set_queue_status(self, position, expected_seconds):
+        with self._condition:
+            self.queue_status = (position, expected_seconds)
+            self._notify()
+
+    def finish(self):
+        with self._condition:
+            if not self.done:
+                self.finished_at = time.monotonic()
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        # Caller holds the condition
+        self._condition.notify_all()
+        for loop, event in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # the consumer's loop has closed; nobody is waiting any more
+
+    def cancel(self):
+        self.cancelled.set()
+        self.finish()
+
+    def iter_chunks(self, on_queue=None, poll_seconds=0.25):
+        """Replay everything published so far, then follow the stream until it finishes"""
+        index = 0
+        shown = None
+        while True:
+            with self._condition:
+                while index >= len(self.chunks) and not self.done and self.queue_status == shown:
+                    self._condition.wait(poll_seconds)
+                pending = self.chunks[index:]
+                index = len(self.chunks)
+                status = self.queue_status
+                finished = self.done and index >= len(self.chunks)
+
+            if on_queue and status is not None and status != shown:
+                on_queue(*status)
+            shown = status
+
+            for text in pending:
+                yield text
+
+            if finished:
+                if not self.cancelled.is_set():
+                    self.delivered = True
+                return
+
+    async def aiter_events(self):
+        """iter_chunks for asyncio consumers: yields ("queue", status) and ("text", chunk) pairs.
+
+        The consumer waits on an asyncio.Event set from the producer thread, so any
+        number of streams can follow flights from one event loop without a thread each.
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._condition:
+            self._async_waiters.add(waiter)
+        index = 0
+        shown = None
+        try:
+            while True:
+                with self._condition:
+                    # Cleared under the lock, so any later publish sets it again
+                    waiter[1].clear()
+                    pending = self.chunks[index:]
+                    index = len(self.chunks)
+                    status = self.queue_status
+                    finished = self.done and index >= len(self.chunks)
+
+                if status is not None and status != shown:
+                    yield "queue", status
+                shown = status
+
+                for text in pending:
+                    yield "text", text
+
+                if finished:
+                    if not self.cancelled.is_set():
+                        self.delivered = True
+                    return
+                await waiter[1].wait()
+        finally:
+            with self._condition:
+                self._async_waiters.discard(waiter)
+
+
+class InflightRegistry:
+    """Per-session single-flight: identical concurrent requests share one upstream call,
+    and a different request from the same session cancels the one still running.
+    Finished flights are kept until delivered, or for retain_seconds when nobody reads them.
+    """
+
+    def __init__(self, retain_seconds=60):
+        self.retain_seconds = retain_seconds
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self.abandoned = 0
+        self._flights = {}  # session_id -> latest Flight
+        self._lock = threading.Lock()
+
+    def start(self, session_id, key, producer):
+        """Join the session's matching flight or start a new one running producer(flight)"""
+        with self._lock:
+            current = self._flights.get(session_id)
+            if current is not None and current.key == key and not current.cancelled.is_set() and not current.delivered:
+                self.coalesced += 1
+                return current
+
+            if current is not None:
+                self._retire(current)
+
+            # Forget other sessions' flights once their output has been delivered, or has
+            # sat unread past the retention period (e.g. the client went away mid-turn)
+            expired = time.monotonic() - self.retain_seconds
+            for other in [
+                sid for sid, f in self._flights.items() if f.done and (f.delivered or f.finished_at < expired)
+            ]:
+                del self._flights[other]
+
+            flight = Flight(session_id, key)
+            self._flights[session_id] = flight
+            self.upstream_calls += 1
+
+        threading.Thread(target=self._run, args=(flight, producer), name="inflight", daemon=True).start()
+        return flight
+
+    def cancel_session(self, session_id):
+        with self._lock:
+            current = self._flights.pop(session_id, None)
+            if current is not None:
+                self._retire(current)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "upstream_calls": self.upstream_calls,
+                "coalesced": self.coalesced,
+                "superseded": self.superseded,
+                "abandoned": self.abandoned,
+                "sessions_in_flight": sum(1 for flight in self._flights.values() if not flight.done),
+            }
+
+    def _retire(self, flight):
+        # Caller holds the lock
+        if not flight.done:
+            self.superseded += 1
+            flight.cancel()
+        if not flight.delivered:
+            self.abandoned += 1
+
+    def _run(self, flight, producer):
+        chunks = producer(flight)
+        try:
+            for text in chunks:
+                if flight.cancelled.is_set():
+                    break
+                flight.publish(text)
+        except Exception as e:
+            log_event("inflight_error", session_id=flight.session_id, error=str(e))
+        finally:
+            chunks.close()
+            flight.finish()
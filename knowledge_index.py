@@ -0,0 +1,220 @@
+"""Offline BM25 index over a local snapshot of the coach's knowledge sources.
+
+Usage:
+    python knowledge_index.py fetch [--snapshot knowledge/snapshot]
+    python knowledge_index.py build [--snapshot knowledge/snapshot] [--out knowledge/index]
+    python knowledge_index.py search "catch-up contribution limit" [--out knowledge/index]
+
+fetch downloads KNOWLEDGE_SOURCES into the snapshot directory (one text file per
+page plus sources.json recording where each came from); the snapshot can also be
+assembled by hand. build splits every document into overlapping chunks and writes
+an index whose BM25 weights are precomputed per (term, chunk), so a query is a few
+array slices and one scatter-add over memory-mapped arrays.
+
+Index layout:
+    meta.json           vocabulary (term -> id), BM25 parameters, chunk count
+    chunks.json         chunk text, source URL and title
+    offsets.npy         int64, postings for term i are [offsets[i], offsets[i + 1])
+    postings_chunk.npy  int32 chunk ids
+    postings_weight.npy float32 BM25 weight of the term in that chunk
+"""
+import argparse
+import functools
+import html
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+KNOWLEDGE_SOURCES = [
+    "https://2025-benefits.segalco.com/",
+    "https://www.psca.org/news/psca-news/",
+]
+
+CHUNK_WORDS = 120
+CHUNK_OVERLAP = 30
+K1 = 1.2
+B = 0.75
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do for from has have how i if in into is it its me my of on or our "
+    "so than that the their them then there these they this to was we what when where which who will "
+    "with you your".split()
+)
+
+
+def tokenize(text):
+    return [token for token in re.findall(r"[a-z0-9]+(?:[.'][a-z0-9]+)*", text.lower()) if token not in STOPWORDS]
+
+
+def chunk_text(text, words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    tokens = text.split()
+    if len(tokens) <= words:
+        return [" ".join(tokens)] if tokens else []
+    step = words - overlap
+    return [" ".join(tokens[start:start + words]) for start in range(0, len(tokens) - overlap, step)]
+
+
+def html_to_text(page):
+    page = re.sub(r"(?is)<(script|style|noscript|svg|nav|footer|header)\b.*?</\1>", " ", page)
+    title = re.search(r"(?is)<title[^>]*>(.*?)</title>", page)
+    text = re.sub(r"(?s)<[^>]+>", "\n", page)
+    text = html.unescape(text)
+    text = "\n".join(line.strip() for line in text.splitlines() if line.strip())
+    return (html.unescape(title.group(1)).strip() if title else ""), text
+
+
+def fetch(snapshot_dir, urls=KNOWLEDGE_SOURCES):
+    """Download each source page as plain text into snapshot_dir"""
+    import requests
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    sources = []
+    for url in urls:
+        response = requests.get(url, timeout=30, headers={"User-Agent": "RetireChat knowledge snapshot"})
+        response.raise_for_status()
+        title, text = html_to_text(response.text)
+        name = re.sub(r"[^a-z0-9]+", "-", url.lower().split("://", 1)[-1]).strip("-") + ".txt"
+        with open(os.path.join(snapshot_dir, name), "w", encoding="utf-8") as f:
+            f.write(text)
+        sources.append({"path": name, "url": url, "title": title or url})
+        print(f"fetched {url} -> {name} ({len(text.split())} words)")
+    with open(os.path.join(snapshot_dir, "sources.json"), "w", encoding="utf-8") as f:
+        json.dump(sources, f, indent=2)
+
+
+def load_snapshot(snapshot_dir):
+    """(title, url, text) for every document listed in sources.json"""
+    with open(os.path.join(snapshot_dir, "sources.json"), encoding="utf-8") as f:
+        sources = json.load(f)
+    for source in sources:
+        with open(os.path.join(snapshot_dir, source["path"]), encoding="utf-8") as f:
+            text = f.read()
+        if source["path"].endswith((".html", ".htm")):
+            text = html_to_text(text)[1]
+        yield source.get("title") or source["url"], source["url"], text
+
+
+def build(snapshot_dir, out_dir):
+    chunks = []
+    for title, url, text in load_snapshot(snapshot_dir):
+        chunks.extend({"text": chunk, "url": url, "title": title} for chunk in chunk_text(text))
+    if not chunks:
+        raise ValueError(f"no documents found in {snapshot_dir}")
+
+    term_counts = [Counter(tokenize(chunk["text"])) for chunk in chunks]
+    lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float64)
+    avg_length = float(lengths.mean()) or 1.0
+
+    postings = {}
+    for chunk_id, counts in enumerate(term_counts):
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((chunk_id, tf))
+
+    vocabulary = {}
+    offsets = [0]
+    chunk_ids = []
+    weights = []
+    for term in sorted(postings):
+        entries = postings[term]
+        idf = math.log(1 + (len(chunks) - len(entries) + 0.5) / (len(entries) + 0.5))
+        for chunk_id, tf in entries:
+            norm = tf + K1 * (1 - B + B * lengths[chunk_id] / avg_length)
+            chunk_ids.append(chunk_id)
+            weights.append(idf * tf * (K1 + 1) / norm)
+        vocabulary[term] = len(vocabulary)
+        offsets.append(len(chunk_ids))
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(out_dir, "postings_chunk.npy"), np.array(chunk_ids, dtype=np.int32))
+    np.save(os.path.join(out_dir, "postings_weight.npy"), np.array(weights, dtype=np.float32))
+    with open(os.path.join(out_dir, "chunks.json"), "w", encoding="utf-8") as f:
+        json.dump(chunks, f)
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"vocabulary": vocabulary, "chunks": len(chunks), "k1": K1, "b": B,
+                   "avg_length": avg_length, "built": time.time()}, f)
+    return len(chunks), len(vocabulary)
+
+
+class KnowledgeIndex:
+    """Read-only BM25 index; postings are memory-mapped rather than read into RAM"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "chunks.json"), encoding="utf-8") as f:
+            self.chunks = json.load(f)
+        self.vocabulary = meta["vocabulary"]
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.postings_chunk = np.load(os.path.join(path, "postings_chunk.npy"), mmap_mode="r")
+        self.postings_weight = np.load(os.path.join(path, "postings_weight.npy"), mmap_mode="r")
+
+    def search(self, query, k=3, min_score=0.0):
+        """Top-k chunks as dicts with text, url, title and score, best first"""
+        term_ids = {self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary}
+        if not term_ids:
+            return []
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for term_id in term_ids:
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            np.add.at(scores, self.postings_chunk[start:stop], self.postings_weight[start:stop])
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [dict(self.chunks[i], score=round(float(scores[i]), 3)) for i in top if scores[i] > min_score]
+
+
+def load_index(path):
+    """Shared index for path, or None when it hasn't been built.
+
+    Keyed on meta.json's mtime (written last by build), so an index built or
+    rebuilt while the app is running is picked up on the next lookup.
+    """
+    try:
+        mtime = os.stat(os.path.join(path, "meta.json")).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return _load_index(path, mtime)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_index(path, mtime):
+    return KnowledgeIndex(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["fetch", "build", "search"])
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("--snapshot", default=os.path.join("knowledge", "snapshot"))
+    parser.add_argument("--out", default=os.path.join("knowledge", "index"))
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "fetch":
+        fetch(args.snapshot)
+    elif args.command == "build":
+        chunks, terms = build(args.snapshot, args.out)
+        print(f"indexed {chunks} chunks, {terms} terms -> {args.out}")
+    else:
+        index = load_index(args.out)
+        if index is None:
+            sys.exit(f"no index at {args.out}; run build first")
+        started = time.perf_counter()
+        results = index.search(args.query, k=args.k)
+        elapsed = (time.perf_counter() - started) * 1000
+        for result in results:
+            print(f"[{result['score']}] {result['title']} <{result['url']}>\n    {result['text'][:200]}...")
+        print(f"{len(results)} results in {elapsed:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return {_format_labels(key) or "total": value for key, value in self._values.items()}
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                _format_labels(key) or "total": {"count": series[-1], "sum": series[-2]}
+                for key, series in self._series.items()
+            }
+
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+    def snapshot(self):
+        return self.read()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        return self._register(name, lambda: Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(name, lambda: Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, read):
+        """Register (or replace) a gauge whose value comes from read()"""
+        with self._lock:
+            self._metrics[name] = Gauge(name, help_text, read)
+            return self._metrics[name]
+
+    def render(self):
+        lines = []
+        for metric in self._all():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {str(e)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        result = {}
+        for metric in self._all():
+            try:
+                result[metric.name] = metric.snapshot()
+            except Exception as e:
+                result[metric.name] = {"error": str(e)}
+        return result
+
+    def _register(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def _all(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+
+REGISTRY = MetricsRegistry()
+
+TURNS = REGISTRY.counter("retirechat_turns_total", "Chat turns by where the answer came from")
+FALLBACKS = REGISTRY.counter("retirechat_fallback_total", "Turns answered with the canned fallback response")
+TURN_SECONDS = REGISTRY.histogram("retirechat_turn_seconds", "End-to-end turn latency")
+TIME_TO_FIRST_TOKEN = REGISTRY.histogram("retirechat_time_to_first_token_seconds", "Time until the first text chunk")
+STAGE_SECONDS = REGISTRY.histogram("retirechat_stage_seconds", "Time spent in each pipeline stage")
+ATTEMPT_SECONDS = REGISTRY.histogram("retirechat_attempt_seconds", "Latency of individual model calls")
+ATTEMPTS_PER_TURN = REGISTRY.histogram(
+    "retirechat_attempts_per_turn", "Model calls made per turn", buckets=(0, 1, 2, 3, 4, 5, 6)
+)
+FINISH_REASONS = REGISTRY.counter("retirechat_finish_reason_total", "Finish reasons reported by Gemini")
+PROMPT_TOKENS = REGISTRY.counter("retirechat_prompt_tokens_total", "Prompt tokens from usage_metadata")
+OUTPUT_TOKENS = REGISTRY.counter("retirechat_output_tokens_total", "Output tokens from usage_metadata")
+
+
+def log_event(event, **fields):
+    """Write one structured JSON log line to stdout"""
+    record = {"event": event, "timestamp": round(time.time(), 3)}
+    record.update(fields)
+    print(json.dumps(record, default=str), flush=True)
+
+
+class TurnMetrics:
+    """Collects the measurements of one chat turn and reports them when it finishes"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.attempts = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.finish_reasons = []
+        self.time_to_first_token = None
+        self.source = None  # set by finish()
+        self.seconds = None
+
+    def attempt(self, attempt_number, seconds, outcome, mode="unary"):
+        self.attempts += 1
+        ATTEMPT_SECONDS.observe(seconds, attempt=attempt_number, outcome=outcome, mode=mode)
+
+    def first_token(self):
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self.started
+            TIME_TO_FIRST_TOKEN.observe(self.time_to_first_token)
+
+    def record_response(self, response):
+        """Pull token usage and finish reason off a (resolved) Gemini response"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+            output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+            self.prompt_tokens += prompt_tokens
+            self.output_tokens += output_tokens
+            PROMPT_TOKENS.inc(prompt_tokens)
+            OUTPUT_TOKENS.inc(output_tokens)
+
+        try:
+            reason = response.candidates[0].finish_reason
+        except (AttributeError, IndexError, TypeError):
+            reason = None
+        if reason is not None:
+            reason = getattr(reason, "name", str(reason))
+            self.finish_reasons.append(reason)
+            FINISH_REASONS.inc(reason=reason)
+
+    def finish(self, source, **fields):
+        seconds = time.perf_counter() - self.started
+        self.source = source
+        self.seconds = seconds
+        TURNS.inc(source=source)
+        TURN_SECONDS.observe(seconds, source=source)
+        ATTEMPTS_PER_TURN.observe(self.attempts)
+        if source == "fallback":
+            FALLBACKS.inc()
+        log_event(
+            "turn",
+            source=source,
+            seconds=round(seconds, 4),
+            time_to_first_token=None if self.time_to_first_token is None else round(self.time_to_first_token, 4),
+            attempts=self.attempts,
+            prompt_tokens=self.prompt_tokens,
+            output_tokens=self.output_tokens,
+            finish_reasons=self.finish_reasons,
+            **fields
+        )
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body = json.dumps(REGISTRY.snapshot(), default=str).encode("utf-8")
+            content_type = "application/json"
+        elif self.path.startswith("/metrics"):
+            body = REGISTRY.render().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port, host="0.0.0.0"):
+    """Serve /metrics (Prometheus text) and /metrics.json once per process"""
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            log_event("metrics_server_error", port=port, error=str(e))
+            return None
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        log_event("metrics_server_started", port=port)
+        return _server
@@ -0,0 +1,222 @@
+"""Offline stand-in for genai.GenerativeModel.
+
+Mimics the parts of the SDK the app relies on (generate_content with and without
+streaming, generate_content_async, count_tokens, response.text, candidates,
+finish_reason and usage_metadata) with configurable latency, finish reasons and
+429/5xx errors, so the chat pipeline can be exercised and benchmarked without the
+live API. Select it with RETIRECHAT_BACKEND=mock.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import protos
+
+FinishReason = protos.Candidate.FinishReason
+
+SENTENCES = [
+    "Thanks for sharing that, it gives me a clearer picture of where you are today.",
+    "A good first step is to confirm how much you contribute to your employer's retirement plan.",
+    "If your employer offers a match, contributing at least enough to capture it is usually worthwhile.",
+    "Increasing your savings rate by one percent each year can make a large difference over time.",
+    "It also helps to build an emergency fund so that unexpected costs don't derail your plan.",
+    "Consider how your investment mix should shift as you get closer to your target retirement age.",
+    "Catch-up contributions become available at age 50 and can accelerate your progress.",
+    "Reviewing your plan once a year keeps your goals and your savings in step with each other.",
+    "Would you like to talk through your timeline or your savings targets next?",
+]
+
+
+def _prompt_text(contents):
+    if isinstance(contents, str):
+        return contents
+    parts = []
+    for content in contents:
+        if isinstance(content, dict):
+            parts.extend(str(part) for part in content.get("parts", []))
+        else:
+            parts.append(str(content))
+    return "\n".join(parts)
+
+
+def _estimate_tokens(text):
+    return max(1, (len(text) + 3) // 4)
+
+
+class _Namespace:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class MockResponse:
+    """Resolved response with the same surface as GenerateContentResponse"""
+
+    def __init__(self, text, finish_reason, prompt_tokens):
+        parts = [_Namespace(text=text)] if text else []
+        self.candidates = [_Namespace(content=_Namespace(parts=parts), finish_reason=finish_reason)]
+        self.prompt_feedback = _Namespace(block_reason=0)
+        self.usage_metadata = _Namespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=_estimate_tokens(text) if text else 0,
+            total_token_count=prompt_tokens + (_estimate_tokens(text) if text else 0),
+        )
+
+    @property
+    def text(self):
+        parts = self.candidates[0].content.parts
+        if not parts:
+            raise ValueError(
+                "Invalid operation: The `response.text` quick accessor requires the response to contain a valid "
+                f"`Part`, but none were returned. The candidate's finish_reason is {int(self.candidates[0].finish_reason)}."
+            )
+        return "".join(part.text for part in parts)
+
+
+class MockStreamResponse:
+    """Streaming response: iterate for chunks, then read it like a resolved response"""
+
+    def __init__(self, model, plan, prompt_tokens):
+        self._model = model
+        self._plan = plan
+        self._prompt_tokens = prompt_tokens
+        self._resolved = None
+
+    def __iter__(self):
+        text, finish_reason, delays, break_after = self._plan
+        pieces = self._model.split_chunks(text)
+        streamed = []
+        for index, piece in enumerate(pieces):
+            time.sleep(delays[min(index, len(delays) - 1)])
+            if break_after is not None and index == break_after:
+                raise google_exceptions.ServiceUnavailable("mock stream interrupted")
+            streamed.append(piece)
+            final = index == len(pieces) - 1
+            yield MockResponse(piece, finish_reason if final else FinishReason.FINISH_REASON_UNSPECIFIED, 0)
+        if not pieces:
+            time.sleep(delays[0])
+            yield MockResponse("", finish_reason, 0)
+        self._resolved = MockResponse("".join(streamed), finish_reason, self._prompt_tokens)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if self._resolved is None:
+            raise ValueError("Iterate over the stream before reading the resolved response.")
+        return getattr(self._resolved, name)
+
+    @property
+    def text(self):
+        return self.__getattr__("text")
+
+
+class MockGenerativeModel:
+    """Local model with a log-normal latency distribution and injectable failures"""
+
+    def __init__(self, model_name="mock-gemini", latency_median=0.8, latency_sigma=0.4,
+                 first_token_fraction=0.25, chunk_count=8, response_words=120,
+                 error_429_rate=0.0, error_5xx_rate=0.0, safety_rate=0.0, stream_break_rate=0.0,
+                 seed=None, **_ignored):
+        self.model_name = model_name
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.first_token_fraction = first_token_fraction
+        self.chunk_count = chunk_count
+        self.response_words = response_words
+        self.error_429_rate = error_429_rate
+        self.error_5xx_rate = error_5xx_rate
+        self.safety_rate = safety_rate
+        self.stream_break_rate = stream_break_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """Build from RETIRECHAT_MOCK_* environment variables"""
+        def number(name, default):
+            return float(os.getenv(f"RETIRECHAT_MOCK_{name}", default))
+
+        settings = {
+            "latency_median": number("LATENCY_MEDIAN", 0.8),
+            "latency_sigma": number("LATENCY_SIGMA", 0.4),
+            "first_token_fraction": number("FIRST_TOKEN_FRACTION", 0.25),
+            "chunk_count": int(number("CHUNKS", 8)),
+            "response_words": int(number("RESPONSE_WORDS", 120)),
+            "error_429_rate": number("ERROR_429_RATE", 0),
+            "error_5xx_rate": number("ERROR_5XX_RATE", 0),
+            "safety_rate": number("SAFETY_RATE", 0),
+            "stream_break_rate": number("STREAM_BREAK_RATE", 0),
+            "seed": int(os.environ["RETIRECHAT_MOCK_SEED"]) if os.getenv("RETIRECHAT_MOCK_SEED") else None,
+        }
+        settings.update(overrides)
+        return cls(**settings)
+
+    def split_chunks(self, text):
+        if not text:
+            return []
+        words = text.split(" ")
+        size = max(1, -(-len(words) // self.chunk_count))
+        return [" ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+                for i in range(0, len(words), size)]
+
+    def _plan(self, contents, generation_config, stream):
+        """Decide the outcome and timing of one call"""
+        with self._lock:
+            self.calls += 1
+            roll = self._random.random()
+            latency = self._random.lognormvariate(0, self.latency_sigma) * self.latency_median
+            breaks = self._random.random() < self.stream_break_rate
+
+        if roll < self.error_429_rate:
+            return google_exceptions.ResourceExhausted("mock quota exceeded"), latency * 0.1
+        roll -= self.error_429_rate
+        if roll < self.error_5xx_rate:
+            return google_exceptions.ServiceUnavailable("mock backend unavailable"), latency * 0.5
+        roll -= self.error_5xx_rate
+
+        if roll < self.safety_rate:
+            text, finish_reason = "", FinishReason.SAFETY
+        else:
+            text, finish_reason = self._compose(_prompt_text(contents), generation_config)
+
+        first = latency * self.first_token_fraction
+        rest = (latency - first) / max(1, self.chunk_count - 1)
+        delays = [first] + [rest] * max(0, self.chunk_count - 1)
+        break_after = 1 if stream and breaks and text else None
+        return (text, finish_reason, delays, break_after), latency
+
+    def _compose(self, prompt, generation_config):
+        words = []
+        index = sum(map(ord, prompt[-64:])) % len(SENTENCES)
+        while len(words) < self.response_words:
+            words.extend(SENTENCES[index % len(SENTENCES)].split(" "))
+            index += 1
+
+        max_output_tokens = getattr(generation_config, "max_output_tokens", None)
+        if max_output_tokens and len(words) > max_output_tokens * 3 // 4:
+            return " ".join(words[:max_output_tokens * 3 // 4]), FinishReason.MAX_TOKENS
+        return " ".join(words[:self.response_words]), FinishReason.STOP
+
+    def generate_content(self, contents, generation_config=None, safety_settings=None, stream=False, **_ignored):
+        plan, latency = self._plan(contents, generation_config, stream)
+        prompt_tokens = _estimate_tokens(_prompt_text(contents))
+        if isinstance(plan, Exception):
+            time.sleep(latency)
+            raise plan
+        if stream:
+            return MockStreamResponse(self, plan, prompt_tokens)
+        time.sleep(latency)
+        return MockResponse(plan[0], plan[1], prompt_tokens)
+
+    async def generate_content_async(self, contents, generation_config=None, safety_settings=None, **_ignored):
+        plan, latency = self._plan(contents, generation_config, False)
+        await asyncio.sleep(latency)
+        if isinstance(plan, Exception):
+            raise plan
+        return MockResponse(plan[0], plan[1], _estimate_tokens(_prompt_text(contents)))
+
+    def count_tokens(self, contents, **_ignored):
+        return _Namespace(total_tokens=_estimate_tokens(_prompt_text(contents)))
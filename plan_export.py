@@ -0,0 +1,303 @@
+"""Background export of the Plan of Action document.
+
+ExportManager runs export jobs on a small worker pool so building the document
+never blocks a chat turn, tracks each job's progress for the UI, and keeps the
+rendered artifacts per (session, conversation version) so asking again for an
+unchanged conversation returns the finished files immediately.
+
+The renderers turn the plan's Markdown into HTML and a plain text PDF without any
+third-party dependency.
+"""
+import html
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import log_event
+
+FORMATS = {
+    "md": ("Markdown", "text/markdown"),
+    "html": ("HTML", "text/html"),
+    "pdf": ("PDF", "application/pdf"),
+}
+
+
+class ExportJob:
+    def __init__(self, session_id, version):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.version = version
+        self.status = "queued"  # queued -> running -> done | failed
+        self.progress = 0.0
+        self.stage = "Waiting for a worker"
+        self.artifacts = {}  # format -> bytes
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def update(self, progress, stage=None):
+        self.progress = max(self.progress, min(progress, 1.0))
+        if stage:
+            self.stage = stage
+
+
+class ExportManager:
+    """Runs exports on a thread pool and caches finished artifacts per conversation version"""
+
+    def __init__(self, max_workers=2, max_cached=64):
+        self.max_cached = max_cached
+        self.cache_hits = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plan-export")
+        self._jobs = OrderedDict()  # (session_id, version) -> ExportJob
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, version, build):
+        """Start build(job) -> {format: bytes}, or return the job already done or running for this version"""
+        key = (session_id, version)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.status != "failed":
+                self._jobs.move_to_end(key)
+                self.cache_hits += 1
+                return job
+            job = ExportJob(session_id, version)
+            self._jobs[key] = job
+            self._evict()
+        self._executor.submit(self._run, job, build)
+        return job
+
+    def get(self, session_id, version):
+        with self._lock:
+            return self._jobs.get((session_id, version))
+
+    def latest(self, session_id):
+        with self._lock:
+            jobs = [job for (sid, _), job in self._jobs.items() if sid == session_id]
+        return max(jobs, key=lambda job: job.created) if jobs else None
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "cached": sum(1 for job in jobs if job.status == "done"),
+            "active": sum(1 for job in jobs if job.active),
+            "cache_hits": self.cache_hits,
+        }
+
+    def _evict(self):
+        # Caller holds the lock; never drop a job that is still running
+        for key in [key for key, job in self._jobs.items() if not job.active]:
+            if len(self._jobs) <= self.max_cached:
+                break
+            del self._jobs[key]
+
+    def _run(self, job, build):
+        job.status = "running"
+        started = time.perf_counter()
+        try:
+            job.artifacts = build(job)
+            job.update(1.0, "Ready")
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        job.finished = time.time()
+        log_event(
+            "plan_export", session_id=job.session_id, version=job.version, status=job.status,
+            seconds=round(time.perf_counter() - started, 4), error=job.error,
+            bytes={fmt: len(data) for fmt, data in job.artifacts.items()}
+        )
+
+
+_INLINE_PATTERNS = [
+    (re.compile(r"\*\*(.+?)\*\*"), r"<strong>\1</strong>"),
+    (re.compile(r"(?<![*\w])\*(?!\s)(.+?)\*(?!\w)"), r"<em>\1</em>"),
+    # The text is already escaped without quotes; the href needs them escaped too
+    (
+        re.compile(r"\[([^\]]+)\]\((https?://[^)\s]+)\)"),
+        lambda m: f'<a href="{html.escape(html.unescape(m.group(2)), quote=True)}">{m.group(1)}</a>'
+    ),
+]
+
+
+def _inline_html(text):
+    text = html.escape(text, quote=False)
+    for pattern, replacement in _INLINE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _plain(text):
+    """Markdown inline syntax reduced to plain text (links keep their URL)"""
+    text = re.sub(r"\[([^\]]+)\]\((https?://[^)\s]+)\)", r"\1 (\2)", text)
+    return re.sub(r"\*\*(.+?)\*\*|(?<![*\w])\*(?!\s)(.+?)\*(?!\w)|`([^`]+)`",
+                  lambda m: m.group(1) or m.group(2) or m.group(3), text)
+
+
+def parse_blocks(markdown):
+    """(kind, level, text) blocks: heading, bullet, numbered, paragraph, rule"""
+    blocks = []
+    paragraph = []
+
+    def flush():
+        if paragraph:
+            blocks.append(("paragraph", 0, " ".join(paragraph)))
+            paragraph.clear()
+
+    for raw in markdown.splitlines():
+        line = raw.strip()
+        heading = re.match(r"(#{1,4})\s+(.*)", line)
+        bullet = re.match(r"[-*+]\s+(.*)", line)
+        numbered = re.match(r"(\d+)[.)]\s+(.*)", line)
+        if not line:
+            flush()
+        elif heading:
+            flush()
+            blocks.append(("heading", len(heading.group(1)), heading.group(2).strip("# ")))
+        elif re.fullmatch(r"[-*_]{3,}", line):
+            flush()
+            blocks.append(("rule", 0, ""))
+        elif bullet:
+            flush()
+            blocks.append(("bullet", (len(raw) - len(raw.lstrip())) // 2, bullet.group(1)))
+        elif numbered:
+            flush()
+            blocks.append(("numbered", int(numbered.group(1)), numbered.group(2)))
+        else:
+            paragraph.append(line)
+    flush()
+    return blocks
+
+
+def markdown_to_html(markdown, title):
+    body = []
+    open_list = None
+    for kind, level, text in parse_blocks(markdown):
+        list_tag = {"bullet": "ul", "numbered": "ol"}.get(kind)
+        if open_list and list_tag != open_list:
+            body.append(f"</{open_list}>")
+            open_list = None
+        if list_tag and not open_list:
+            body.append(f"<{list_tag}>")
+            open_list = list_tag
+        if kind == "heading":
+            body.append(f"<h{level + 1}>{_inline_html(text)}</h{level + 1}>")
+        elif kind == "rule":
+            body.append("<hr>")
+        elif list_tag:
+            body.append(f"<li>{_inline_html(text)}</li>")
+        else:
+            body.append(f"<p>{_inline_html(text)}</p>")
+    if open_list:
+        body.append(f"</{open_list}>")
+
+    return (
+        "<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"utf-8\">\n"
+        f"<title>{html.escape(title)}</title>\n"
+        "<style>\n"
+        "body { font-family: Helvetica, Arial, sans-serif; max-width: 46rem; margin: 2rem auto; color: #222; "
+        "line-height: 1.5; }\n"
+        "h1 { color: #1E3A5F; border-bottom: 3px solid #2B5A9E; padding-bottom: 0.4rem; }\n"
+        "h2, h3, h4 { color: #2B5A9E; }\n"
+        "@media print { body { margin: 0; } a { color: inherit; } }\n"
+        "</style>\n</head>\n<body>\n"
+        f"<h1>{html.escape(title)}</h1>\n" + "\n".join(body) + "\n</body>\n</html>\n"
+    )
+
+
+def _wrap(text, width):
+    lines = []
+    current = ""
+    for word in text.split():
+        if current and len(current) + 1 + len(word) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        lines.append(current)
+    return lines or [""]
+
+
+def _pdf_escape(text):
+    text = text.encode("cp1252", "replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def markdown_to_pdf(markdown, title):
+    """Single-column US Letter PDF using the built-in Helvetica fonts"""
+    styles = {"title": ("F2", 18, 26), "heading": ("F2", 13, 20), "body": ("F1", 10.5, 14.5)}
+    margin, top, bottom = 60, 740, 60
+
+    lines = [("title", title, 0), (None, "", 0)]
+    for kind, level, text in parse_blocks(markdown):
+        if kind == "heading":
+            lines.extend([(None, "", 0)] + [("heading", line, 0) for line in _wrap(_plain(text), 70)])
+        elif kind == "rule":
+            lines.append((None, "", 0))
+        elif kind in ("bullet", "numbered"):
+            marker = "\u2022" if kind == "bullet" else f"{level}."
+            indent = 14 + (12 * level if kind == "bullet" else 0)
+            wrapped = _wrap(_plain(text), 92 - indent // 5)
+            lines.append(("body", f"{marker} {wrapped[0]}", indent))
+            lines.extend(("body", line, indent + 10) for line in wrapped[1:])
+        else:
+            lines.extend(("body", line, 0) for line in _wrap(_plain(text), 95))
+            lines.append((None, "", 0))
+
+    pages = []
+    stream = []
+    y = top
+    for style, text, indent in lines:
+        font, size, leading = styles[style or "body"]
+        if y - leading < bottom:
+            pages.append(stream)
+            stream, y = [], top
+        y -= leading
+        if text:
+            stream.append(f"BT /{font} {size} Tf {margin + indent} {y} Td ({_pdf_escape(text)}) Tj ET")
+    pages.append(stream)
+
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once page ids are known
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+    ]
+    page_ids = []
+    for number, page in enumerate(pages, 1):
+        content = "\n".join(page + [f"BT /F1 8 Tf {margin} 30 Td (Page {number} of {len(pages)}) Tj ET"])
+        objects.append(f"<< /Length {len(content.encode('latin-1'))} >>\nstream\n{content}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {len(objects)} 0 R "
+            "/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> >>"
+        )
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return bytes(output)
+
+
+def render_plan(markdown, title):
+    """All export formats for one plan"""
+    return {
+        "md": f"# {title}\n\n{markdown.strip()}\n".encode("utf-8"),
+        "html": markdown_to_html(markdown, title).encode("utf-8"),
+        "pdf": markdown_to_pdf(markdown, title),
+    }
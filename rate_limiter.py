@@ -0,0 +1,190 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+
+
+class AdmissionTimeout(Exception):
+    """Raised when a request waits in the queue longer than allowed"""
+
+
+class AdmissionCancelled(Exception):
+    """Raised when the caller gave up on a request while it was still queued"""
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at capacity per minute"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` tokens are available (0 if they are now)"""
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class Ticket:
+    """A request's place in the admission queue"""
+
+    def __init__(self, ticket_id, tokens):
+        self.id = ticket_id
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.admitted = False
+        self.released = False
+
+
+class AdmissionController:
+    """Process-wide admission for model calls: a bounded number in flight, requests-per-minute
+    and tokens-per-minute buckets, and a FIFO queue so sessions are served in arrival order.
+    """
+
+    def __init__(self, max_in_flight=16, requests_per_minute=600, tokens_per_minute=1000000):
+        self.max_in_flight = max_in_flight
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.in_flight = 0
+        self._queue = deque()
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._avg_call_seconds = 2.0
+
+    def enqueue(self, tokens):
+        with self._condition:
+            ticket = Ticket(next(self._ids), tokens)
+            self._queue.append(ticket)
+            return ticket
+
+    def try_admit(self, ticket):
+        """Admit the ticket if it is at the head of the queue and capacity allows"""
+        with self._condition:
+            if ticket.admitted:
+                return True
+            if not self._queue or self._queue[0] is not ticket or self.in_flight >= self.max_in_flight:
+                return False
+
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            if self.requests.wait_time(1) > 0 or self.tokens.wait_time(ticket.tokens) > 0:
+                return False
+
+            self.requests.tokens -= 1
+            self.tokens.tokens -= min(ticket.tokens, self.tokens.capacity)
+            self._queue.popleft()
+            self.in_flight += 1
+            ticket.admitted = True
+            ticket.admitted_at = now
+            self._condition.notify_all()
+            return True
+
+    def release(self, ticket):
+        """Give back the in-flight slot, or leave the queue if never admitted"""
+        with self._condition:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.admitted:
+                self.in_flight -= 1
+                elapsed = time.monotonic() - ticket.admitted_at
+                self._avg_call_seconds = 0.9 * self._avg_call_seconds + 0.1 * elapsed
+            else:
+                try:
+                    self._queue.remove(ticket)
+                except ValueError:
+                    pass
+            self._condition.notify_all()
+
+    def position(self, ticket):
+        """1-based queue position, or 0 once admitted"""
+        with self._condition:
+            if ticket.admitted:
+                return 0
+            for index, queued in enumerate(self._queue):
+                if queued is ticket:
+                    return index + 1
+            return 0
+
+    def expected_wait(self, ticket):
+        """Rough seconds until the ticket is admitted"""
+        with self._condition:
+            if ticket.admitted:
+                return 0.0
+            ahead = []
+            for queued in self._queue:
+                ahead.append(queued)
+                if queued is ticket:
+                    break
+
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            rate_wait = max(
+                self.requests.wait_time(len(ahead)),
+                self.tokens.wait_time(sum(queued.tokens for queued in ahead))
+            )
+            slots_needed = max(0, self.in_flight + len(ahead) - self.max_in_flight)
+            slot_wait = slots_needed / self.max_in_flight * self._avg_call_seconds
+            return max(rate_wait, slot_wait)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "in_flight": self.in_flight,
+                "queued": len(self._queue),
+                "avg_call_seconds": self._avg_call_seconds,
+            }
+
+    def acquire(self, tokens, on_wait=None, timeout=None, cancel_event=None, poll_seconds=0.25):
+        """Block until admitted; on_wait(position, expected_seconds) is called while queued"""
+        ticket = self.enqueue(tokens)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        queued = False
+        try:
+            while not self.try_admit(ticket):
+                queued = True
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise AdmissionTimeout(f"not admitted within {timeout}s")
+                if cancel_event is not None and cancel_event.is_set():
+                    raise AdmissionCancelled("request cancelled while queued")
+                if on_wait:
+                    on_wait(self.position(ticket), self.expected_wait(ticket))
+                with self._condition:
+                    self._condition.wait(poll_seconds)
+        except BaseException:
+            self.release(ticket)
+            raise
+        if queued and on_wait:
+            on_wait(0, 0.0)
+        return ticket
+
+    async def acquire_async(self, tokens, on_wait=None, timeout=None, poll_seconds=0.05):
+        """Async variant of acquire(); cancelling the caller leaves the queue cleanly"""
+        ticket = self.enqueue(tokens)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        queued = False
+        try:
+            while not self.try_admit(ticket):
+                queued = True
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise AdmissionTimeout(f"not admitted within {timeout}s")
+                if on_wait:
+                    on_wait(self.position(ticket), self.expected_wait(ticket))
+                await asyncio.sleep(poll_seconds)
+        except BaseException:
+            self.release(ticket)
+            raise
+        if queued and on_wait:
+            on_wait(0, 0.0)
+        return ticket
@@ -0,0 +1,182 @@
+"""Monte Carlo retirement projections, simulated locally with NumPy.
+
+project_retirement() simulates thousands of market-return and inflation paths at
+once (one vectorized step per year across all paths) and reports the probability
+that savings last to life expectancy plus percentile balances in today's dollars.
+Results are memoized on the rounded inputs and use a fixed seed, so the same
+question always gets the same numbers.
+
+PROJECT_RETIREMENT_TOOL declares the function to Gemini for function calling.
+"""
+import copy
+import functools
+
+import numpy as np
+
+DEFAULT_SIMULATIONS = 5000
+MAX_SIMULATIONS = 50000
+SEED = 20240601
+PERCENTILES = (10, 25, 50, 75, 90)
+# Caps the simulated horizon (and its memory), since the model supplies the ages
+MAX_AGE = 120
+# Accepted range per rate argument; rates are fractions, so a model passing 6 for 6% is rejected
+RATE_RANGES = {
+    "contribution_rate": (0.0, 1.0),
+    "employer_match_rate": (0.0, 1.0),
+    "expected_return": (-0.1, 0.2),
+    "return_volatility": (0.0, 0.5),
+    "inflation": (-0.05, 0.2),
+    "inflation_volatility": (0.0, 0.1),
+    "salary_growth": (-0.1, 0.2),
+}
+
+PROJECT_RETIREMENT_TOOL = {
+    "function_declarations": [{
+        "name": "project_retirement",
+        "description": (
+            "Run a Monte Carlo retirement projection. Returns the probability that savings last until "
+            "life expectancy and percentile savings balances (in today's dollars) at retirement and at "
+            "life expectancy. Use it for savings targets, 'am I on track' and retirement-age questions."
+        ),
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "current_age": {"type": "number", "description": "The user's age today"},
+                "retirement_age": {"type": "number", "description": "Age at which the user plans to retire"},
+                "current_savings": {"type": "number", "description": "Total retirement savings today, in dollars"},
+                "annual_income": {"type": "number", "description": "Current gross annual income, in dollars"},
+                "contribution_rate": {
+                    "type": "number", "description": "Share of income the user saves each year, e.g. 0.06 for 6%"
+                },
+                "employer_match_rate": {
+                    "type": "number", "description": "Employer contribution as a share of income, e.g. 0.03"
+                },
+                "annual_spending": {
+                    "type": "number",
+                    "description": "Desired yearly spending in retirement in today's dollars; "
+                                   "defaults to 80% of income at retirement"
+                },
+                "other_retirement_income": {
+                    "type": "number",
+                    "description": "Yearly income in retirement from other sources (e.g. Social Security, "
+                                   "pension) in today's dollars"
+                },
+                "life_expectancy": {"type": "number", "description": "Age the savings must last to (at most 120), default 95"},
+                "expected_return": {
+                    "type": "number", "description": "Mean nominal annual portfolio return, default 0.06"
+                },
+            },
+            "required": ["current_age", "retirement_age", "current_savings"],
+        },
+    }]
+}
+
+
+def project_retirement(current_age, retirement_age, current_savings, annual_income=0.0, contribution_rate=0.10,
+                       employer_match_rate=0.0, annual_spending=None, other_retirement_income=0.0,
+                       life_expectancy=95, expected_return=0.06, return_volatility=0.12, inflation=0.025,
+                       inflation_volatility=0.01, salary_growth=0.01, simulations=DEFAULT_SIMULATIONS):
+    """Simulate savings paths to life expectancy; raises ValueError for impossible inputs"""
+    current_age = int(round(current_age))
+    retirement_age = int(round(retirement_age))
+    life_expectancy = int(round(life_expectancy))
+    if not 0 <= current_age <= retirement_age:
+        raise ValueError("retirement_age must not be before current_age")
+    if life_expectancy <= max(current_age, retirement_age):
+        raise ValueError("life_expectancy must be after retirement_age")
+    if life_expectancy > MAX_AGE:
+        raise ValueError(f"ages must be at most {MAX_AGE}")
+    if current_savings < 0 or annual_income < 0:
+        raise ValueError("savings and income must not be negative")
+    if (annual_spending is not None and annual_spending < 0) or other_retirement_income < 0:
+        raise ValueError("retirement spending and income must not be negative")
+    rates = {
+        "contribution_rate": contribution_rate, "employer_match_rate": employer_match_rate,
+        "expected_return": expected_return, "return_volatility": return_volatility, "inflation": inflation,
+        "inflation_volatility": inflation_volatility, "salary_growth": salary_growth,
+    }
+    for name, value in rates.items():
+        low, high = RATE_RANGES[name]
+        if not low <= value <= high:
+            raise ValueError(f"{name} must be a fraction between {low} and {high} (e.g. 0.06 for 6%), got {value}")
+
+    # Round to the precision that matters so near-identical questions share a cache entry
+    result = _simulate(
+        current_age, retirement_age, life_expectancy,
+        round(float(current_savings), -2), round(float(annual_income), -2),
+        round(float(contribution_rate), 4), round(float(employer_match_rate), 4),
+        None if annual_spending is None else round(float(annual_spending), -2),
+        round(float(other_retirement_income), -2),
+        round(float(expected_return), 4), round(float(return_volatility), 4),
+        round(float(inflation), 4), round(float(inflation_volatility), 4), round(float(salary_growth), 4),
+        int(min(max(simulations, 100), MAX_SIMULATIONS)),
+    )
+    return copy.deepcopy(result)
+
+
+@functools.lru_cache(maxsize=512)
+def _simulate(current_age, retirement_age, life_expectancy, current_savings, annual_income, contribution_rate,
+              employer_match_rate, annual_spending, other_retirement_income, expected_return, return_volatility,
+              inflation, inflation_volatility, salary_growth, simulations):
+    rng = np.random.default_rng(SEED)
+    working_years = retirement_age - current_age
+    retired_years = life_expectancy - retirement_age
+    years = working_years + retired_years
+
+    returns = np.maximum(rng.normal(expected_return, return_volatility, (simulations, years)), -0.95)
+    inflation_paths = rng.normal(inflation, inflation_volatility, (simulations, years))
+    # Price level at the start of each year, relative to today
+    price_level = np.cumprod(np.hstack([np.ones((simulations, 1)), 1 + inflation_paths]), axis=1)
+
+    # Real salary grows by salary_growth; contributions are paid in that year's dollars
+    real_salary = annual_income * (1 + salary_growth) ** np.arange(working_years)
+    contributions = real_salary * (contribution_rate + employer_match_rate) * price_level[:, :working_years]
+
+    balance = np.full(simulations, current_savings)
+    for year in range(working_years):
+        balance = (balance + contributions[:, year]) * (1 + returns[:, year])
+    at_retirement = balance / price_level[:, working_years]
+
+    if annual_spending is None:
+        annual_spending = 0.8 * annual_income * (1 + salary_growth) ** working_years
+    real_withdrawal = max(annual_spending - other_retirement_income, 0.0)
+
+    depleted_at = np.full(simulations, np.inf)
+    for offset in range(retired_years):
+        year = working_years + offset
+        balance = (balance - real_withdrawal * price_level[:, year]) * (1 + returns[:, year])
+        newly_depleted = (balance <= 0) & np.isinf(depleted_at)
+        depleted_at[newly_depleted] = retirement_age + offset
+        balance = np.maximum(balance, 0.0)
+    at_life_expectancy = balance / price_level[:, years]
+
+    # "lower" picks an actual path's age; interpolating between two never-depleted (inf) paths gives NaN
+    depletion_age = np.percentile(depleted_at, 10, method="lower")
+    return {
+        "success_probability": round(float(np.mean(np.isinf(depleted_at))), 3),
+        "balance_at_retirement": _percentiles(at_retirement),
+        "balance_at_life_expectancy": _percentiles(at_life_expectancy),
+        "depletion_age_10th_percentile": None if np.isinf(depletion_age) else int(depletion_age),
+        "annual_retirement_spending": round(float(annual_spending), -2),
+        "years_to_retirement": working_years,
+        "simulations": simulations,
+        "assumptions": {
+            "expected_return": expected_return,
+            "return_volatility": return_volatility,
+            "inflation": inflation,
+            "salary_growth": salary_growth,
+            "contribution_rate": contribution_rate,
+            "employer_match_rate": employer_match_rate,
+            "other_retirement_income": other_retirement_income,
+            "life_expectancy": life_expectancy,
+            "dollars": "today's dollars",
+        },
+    }
+
+
+def _percentiles(values):
+    return {f"p{p}": round(float(v), -2) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+def cache_info():
+    return _simulate.cache_info()
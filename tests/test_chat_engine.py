@@ -0,0 +1,176 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("RETIRECHAT_BACKEND", "mock")
+os.environ.setdefault("RETIRECHAT_METRICS_PORT", "0")
+os.environ.setdefault("RETIRECHAT_CONVERSATION_DB", "")
+os.environ.setdefault("RETIRECHAT_WARMUP", "false")
+os.environ.setdefault("RETIRECHAT_MOCK_LATENCY_MEDIAN", "0.05")
+
+import chat_engine
+from chat_engine import ConversationContext, LatencyTracker, StreamTimeout, TimedStream
+from rate_limiter import AdmissionController
+
+
+def message(role, content):
+    return {"role": role, "content": content}
+
+
+def test_window_keeps_newest_messages_within_budget():
+    history = [message("user", "word " * 40) for _ in range(10)]
+    context = ConversationContext(token_budget=120)
+
+    window = context.window(history)
+
+    assert window[0]["role"] == "summary"
+    assert window[1:] == history[-len(window) + 1:]
+    assert context.summarized_count == 10 - (len(window) - 1)
+
+
+def test_window_summarizes_facts_from_evicted_turns():
+    history = [message("user", "I am 45 and I want to retire at 63."), message("assistant", "ok " * 200)]
+    history += [message("user", "hi"), message("assistant", "hello")]
+    context = ConversationContext(token_budget=60)
+
+    summary = context.window(history)[0]["content"]
+
+    assert "Age: 45" in summary
+    assert "Target retirement age: 63" in summary
+
+
+def test_fold_evicted_folds_each_message_once():
+    context = ConversationContext()
+    context.fold_evicted(0, message("user", "I am 45. My goal is to retire early."))
+    context.fold_evicted(0, message("user", "I am 45. My goal is to retire early."))
+
+    assert context.summarized_count == 1
+    assert len(context.goals) == 1
+
+
+def test_window_resets_after_history_is_cleared():
+    context = ConversationContext(token_budget=20)
+    context.window([message("user", "I am 45 " + "x " * 100)] * 3)
+
+    window = context.window([message("user", "hi")])
+
+    assert window == [message("user", "hi")]
+
+
+def test_timed_stream_raises_when_first_chunk_is_late():
+    release = threading.Event()
+
+    def open_stream():
+        release.wait(5)
+        return iter(["late"])
+
+    with pytest.raises(StreamTimeout):
+        list(TimedStream(open_stream, time.perf_counter() + 5, first_chunk_timeout=0.05))
+    release.set()
+
+
+def test_timed_stream_passes_chunks_and_keeps_the_response():
+    stream = TimedStream(lambda: ["a", "b"], time.perf_counter() + 5)
+
+    assert list(stream) == ["a", "b"]
+    assert stream.response == ["a", "b"]
+
+
+def run_scheduler(monkeypatch, attempt, **kwargs):
+    monkeypatch.setattr(chat_engine, "get_ai_response_attempt", attempt)
+    monkeypatch.setattr(chat_engine, "backoff_delay", lambda failures: 0.0)
+    return asyncio.run(chat_engine.get_ai_response_with_retry_async(
+        "How much should I save?", [], pool=object(), tracker=LatencyTracker(), admission=AdmissionController(),
+        **kwargs
+    ))
+
+
+def test_scheduler_gives_up_at_the_turn_deadline(monkeypatch):
+    async def hangs(*args, on_admitted=None, **kwargs):
+        on_admitted()
+        await asyncio.sleep(60)
+
+    started = time.perf_counter()
+    assert run_scheduler(monkeypatch, hangs, time_budget=0.2) is None
+    assert time.perf_counter() - started < 2
+
+
+def test_scheduler_retries_transient_errors(monkeypatch):
+    calls = []
+
+    async def flaky(user_input, history, attempt, on_admitted=None, **kwargs):
+        calls.append(attempt)
+        on_admitted()
+        if len(calls) == 1:
+            raise chat_engine.google_exceptions.ServiceUnavailable("busy")
+        return "answer"
+
+    assert run_scheduler(monkeypatch, flaky) == "answer"
+    assert calls == [0, 0]
+
+
+def test_scheduler_moves_to_the_next_strategy_after_an_unusable_answer(monkeypatch):
+    calls = []
+
+    async def blocked_first(user_input, history, attempt, on_admitted=None, **kwargs):
+        calls.append(attempt)
+        on_admitted()
+        return None if attempt == 0 else "answer"
+
+    assert run_scheduler(monkeypatch, blocked_first) == "answer"
+    assert calls == [0, 1]
+
+
+def test_scheduler_hedges_a_slow_admitted_attempt(monkeypatch):
+    monkeypatch.setattr(chat_engine, "DEFAULT_HEDGE_DELAY_SECONDS", 0.05)
+    monkeypatch.setattr(chat_engine, "HEDGING_ENABLED", True)
+
+    async def first_is_slow(user_input, history, attempt, on_admitted=None, **kwargs):
+        on_admitted()
+        await asyncio.sleep(5 if attempt == 0 else 0.01)
+        return f"answer {attempt}"
+
+    assert run_scheduler(monkeypatch, first_is_slow) == "answer 1"
+
+
+def test_scheduler_does_not_hedge_an_attempt_still_queued(monkeypatch):
+    monkeypatch.setattr(chat_engine, "DEFAULT_HEDGE_DELAY_SECONDS", 0.05)
+    monkeypatch.setattr(chat_engine, "HEDGING_ENABLED", True)
+    calls = []
+
+    async def queued_then_fast(user_input, history, attempt, on_admitted=None, **kwargs):
+        calls.append(attempt)
+        await asyncio.sleep(0.3)  # waiting for admission
+        on_admitted()
+        return "answer"
+
+    assert run_scheduler(monkeypatch, queued_then_fast) == "answer"
+    assert calls == [0]
+
+
+def test_coalesced_replies_record_the_turn_once():
+    session = chat_engine.ChatSession()
+
+    async def both():
+        async def reply():
+            return [event async for event in session.reply_events("hello there")]
+        return await asyncio.gather(reply(), reply())
+
+    first, second = asyncio.run(both())
+
+    assert first[-1] == second[-1]
+    assert first[-1][0] == "done"
+    assert [m.role for m in session.conversation[0:len(session.conversation)]] == ["user", "assistant"]
+
+
+def test_session_rejects_ids_it_did_not_issue():
+    with pytest.raises(ValueError):
+        chat_engine.ChatSession("../../etc/passwd")
+    session_id = chat_engine.new_session_id()
+    assert chat_engine.ChatSession(session_id).session_id == session_id
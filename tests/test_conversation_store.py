@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_store import ConversationStore, SQLiteConversationBackend
+
+
+def test_backend_assigns_positions_in_append_order(tmp_path):
+    backend = SQLiteConversationBackend(str(tmp_path / "c.db"))
+    for text in ("one", "two", "three"):
+        backend.append("s", "user", text)
+
+    assert backend.count("s") == 3
+    assert [tuple(row) for row in backend.load("s", 0, 3)] == [(0, "user", "one"), (1, "user", "two"), (2, "user", "three")]
+
+
+def test_two_writers_for_one_session_do_not_overwrite_each_other(tmp_path):
+    path = str(tmp_path / "c.db")
+    first, second = SQLiteConversationBackend(path), SQLiteConversationBackend(path)
+    for index in range(20):
+        first.append("s", "user", f"a{index}")
+        second.append("s", "user", f"b{index}")
+    first.flush()
+    second.flush()
+
+    rows = first.load("s", 0, 100)
+    assert [row[0] for row in rows] == list(range(40))
+    assert sorted(row[2] for row in rows) == sorted([f"a{i}" for i in range(20)] + [f"b{i}" for i in range(20)])
+
+
+def test_clear_applies_in_call_order(tmp_path):
+    backend = SQLiteConversationBackend(str(tmp_path / "c.db"))
+    backend.append("s", "user", "old")
+    backend.clear("s")
+    backend.append("s", "user", "new")
+
+    assert [tuple(row) for row in backend.load("s", 0, 10)] == [(0, "user", "new")]
+
+
+def test_flush_for_one_session_leaves_the_others_pending(tmp_path):
+    backend = SQLiteConversationBackend(str(tmp_path / "c.db"))
+    backend.append("a", "user", "hi")
+    backend.append("b", "user", "hi")
+    backend.flush("a")
+
+    assert backend.count("a") == 1
+    backend.flush()
+    assert backend.stats()["pending_writes"] == 0
+
+
+def test_idle_sessions_are_purged_after_the_retention_period(tmp_path):
+    path = str(tmp_path / "c.db")
+    writer = SQLiteConversationBackend(path)
+    writer.append("stale", "user", "old")
+    writer.append("fresh", "user", "new")
+    writer.flush()
+    db = sqlite3.connect(path)
+    db.execute("UPDATE messages SET created = ? WHERE session_id = 'stale'", (time.time() - 10 * 86400,))
+    db.commit()
+
+    backend = SQLiteConversationBackend(path, retention_days=7)
+    deadline = time.monotonic() + 5
+    while not backend.stats()["rows_purged"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert backend.count("stale") == 0
+    assert backend.count("fresh") == 1
+    assert backend.stats()["rows_purged"] == 1
+
+
+def test_resume_keeps_the_newest_messages_and_folds_the_rest(tmp_path):
+    backend = SQLiteConversationBackend(str(tmp_path / "c.db"))
+    store = ConversationStore("s", max_messages=0, backend=backend)
+    for index in range(5):
+        store.append("user", f"m{index}")
+
+    evicted = []
+    resumed = ConversationStore.resume("s", backend, max_messages=2, on_evict=lambda i, m: evicted.append((i, m.content)))
+
+    assert len(resumed) == 5
+    assert resumed.first_index == 3
+    assert [m.content for m in resumed[3:5]] == ["m3", "m4"]
+    assert evicted == [(0, "m0"), (1, "m1"), (2, "m2")]
+    assert [m.content for m in resumed.page(0, 5)] == ["m0", "m1", "m2", "m3", "m4"]
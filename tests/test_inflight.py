@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inflight import InflightRegistry
+
+
+def producer_of(chunks, release=None):
+    def producer(flight):
+        def generate():
+            if release is not None:
+                release.wait(5)
+            yield from chunks
+        return generate()
+    return producer
+
+
+def wait_done(flight):
+    deadline = time.monotonic() + 5
+    while not flight.done and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert flight.done
+
+
+def test_identical_request_joins_the_running_flight():
+    registry = InflightRegistry()
+    release = threading.Event()
+    first = registry.start("s", "key", producer_of(["a", "b"], release))
+    second = registry.start("s", "key", producer_of(["never"]))
+    release.set()
+
+    assert second is first
+    assert list(first.iter_chunks()) == ["a", "b"]
+    assert registry.stats()["upstream_calls"] == 1
+    assert registry.stats()["coalesced"] == 1
+
+
+def test_late_consumer_replays_what_already_streamed():
+    registry = InflightRegistry()
+    flight = registry.start("s", "key", producer_of(["a", "b", "c"]))
+    wait_done(flight)
+
+    assert list(flight.iter_chunks()) == ["a", "b", "c"]
+    assert list(flight.iter_chunks()) == ["a", "b", "c"]
+
+
+def test_different_request_supersedes_the_running_flight():
+    registry = InflightRegistry()
+    release = threading.Event()
+    old = registry.start("s", "old", producer_of(["stale"], release))
+    new = registry.start("s", "new", producer_of(["fresh"]))
+    release.set()
+
+    assert new is not old
+    assert old.cancelled.is_set()
+    assert list(new.iter_chunks()) == ["fresh"]
+    assert registry.stats()["superseded"] == 1
+
+
+def test_delivered_flight_is_not_joined_again():
+    registry = InflightRegistry()
+    first = registry.start("s", "key", producer_of(["a"]))
+    list(first.iter_chunks())
+
+    second = registry.start("s", "key", producer_of(["b"]))
+
+    assert second is not first
+    assert registry.stats()["upstream_calls"] == 2
+
+
+def test_unread_finished_flights_expire():
+    registry = InflightRegistry(retain_seconds=0.05)
+    unread = registry.start("gone", "key", producer_of(["a"]))
+    wait_done(unread)
+    time.sleep(0.1)
+
+    registry.start("other", "key", producer_of(["b"]))
+
+    assert "gone" not in registry._flights
+
+
+def test_recent_unread_flights_are_kept():
+    registry = InflightRegistry(retain_seconds=60)
+    unread = registry.start("waiting", "key", producer_of(["a"]))
+    wait_done(unread)
+
+    registry.start("other", "key", producer_of(["b"]))
+
+    assert registry._flights["waiting"] is unread
@@ -0,0 +1,18 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plan_export import _inline_html
+
+
+def test_link_href_cannot_break_out_of_its_attribute():
+    rendered = _inline_html('[site](https://example.com/?q="onmouseover=alert(1))')
+
+    assert '<a href="https://example.com/?q=&quot;onmouseover=alert(1">site</a>' in rendered
+
+
+def test_link_query_ampersands_are_escaped_once():
+    rendered = _inline_html("[site](https://example.com/?a=1&b=2)")
+
+    assert rendered == '<a href="https://example.com/?a=1&amp;b=2">site</a>'
@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limiter import AdmissionController, AdmissionTimeout
+
+
+def test_requests_are_admitted_in_arrival_order():
+    admission = AdmissionController(max_in_flight=1)
+    running = admission.acquire(1)
+    second = admission.enqueue(1)
+    third = admission.enqueue(1)
+    admission.release(running)
+
+    assert not admission.try_admit(third)
+    assert admission.try_admit(second)
+    assert admission.position(third) == 1
+
+
+def test_in_flight_limit_holds_until_release():
+    admission = AdmissionController(max_in_flight=2)
+    first = admission.acquire(1)
+    admission.acquire(1)
+    waiting = admission.enqueue(1)
+
+    assert not admission.try_admit(waiting)
+    admission.release(first)
+    assert admission.try_admit(waiting)
+
+
+def test_requests_per_minute_limit():
+    admission = AdmissionController(max_in_flight=10, requests_per_minute=2)
+    admission.acquire(1)
+    admission.acquire(1)
+
+    assert not admission.try_admit(admission.enqueue(1))
+
+
+def test_tokens_per_minute_limit():
+    admission = AdmissionController(max_in_flight=10, tokens_per_minute=100)
+    admission.acquire(80)
+    too_big = admission.enqueue(80)
+
+    assert not admission.try_admit(too_big)
+    # Once it gives up, a request that fits the remaining budget goes through
+    admission.release(too_big)
+    assert admission.try_admit(admission.enqueue(20))
+
+
+def test_timed_out_request_leaves_the_queue():
+    admission = AdmissionController(max_in_flight=1)
+    admission.acquire(1)
+
+    with pytest.raises(AdmissionTimeout):
+        admission.acquire(1, timeout=0.05, poll_seconds=0.01)
+    assert admission.stats()["queued"] == 0
+
+
+def test_release_is_idempotent():
+    admission = AdmissionController(max_in_flight=1)
+    ticket = admission.acquire(1)
+    admission.release(ticket)
+    admission.release(ticket)
+
+    assert admission.stats()["in_flight"] == 0
@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import response_cache
+from response_cache import ResponseCache
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(ttl_seconds=10)
+    cache.put("k", "answer")
+
+    now[0] += 5
+    assert cache.get("k") == "answer"
+    now[0] += 10
+    assert cache.get("k") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+def test_persistent_cache_survives_a_restart(tmp_path):
+    path = str(tmp_path / "responses.db")
+    ResponseCache(path=path).put("k", "answer")
+
+    assert ResponseCache(path=path).get("k") == "answer"
+
+
+def test_key_ignores_whitespace_and_case_of_the_prompt():
+    assert ResponseCache.make_key("How much  should I save?", []) == ResponseCache.make_key("how much should i save?", [])
+
+
+def test_key_covers_history_and_every_config_field():
+    base = ResponseCache.make_key("q", [("user", "hi")], "model", "system", "prompt v1")
+
+    assert ResponseCache.make_key("q", [("user", "hello")], "model", "system", "prompt v1") != base
+    assert ResponseCache.make_key("q", [("user", "hi")], "other-model", "system", "prompt v1") != base
+    assert ResponseCache.make_key("q", [("user", "hi")], "model", "system", "prompt v2") != base
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retirement_projection import project_retirement
+
+
+def test_well_funded_plan_reports_no_depletion_age():
+    result = project_retirement(current_age=35, retirement_age=65, current_savings=50000)
+
+    assert result["success_probability"] >= 0.9
+    assert result["depletion_age_10th_percentile"] is None
+
+
+def test_underfunded_plan_reports_depletion_age():
+    result = project_retirement(
+        current_age=60, retirement_age=62, current_savings=50000, annual_income=80000, annual_spending=60000
+    )
+
+    assert result["success_probability"] < 0.9
+    assert 62 <= result["depletion_age_10th_percentile"] < 95
+
+
+def test_rejects_retirement_before_current_age():
+    with pytest.raises(ValueError):
+        project_retirement(current_age=50, retirement_age=40, current_savings=0)
+
+
+def test_rejects_life_expectancy_beyond_max_age():
+    with pytest.raises(ValueError):
+        project_retirement(current_age=40, retirement_age=65, current_savings=0, life_expectancy=1500)
+
+
+@pytest.mark.parametrize("argument", ["contribution_rate", "employer_match_rate", "expected_return", "inflation"])
+def test_rejects_percentages_passed_as_whole_numbers(argument):
+    with pytest.raises(ValueError, match=argument):
+        project_retirement(current_age=40, retirement_age=65, current_savings=0, **{argument: 6})